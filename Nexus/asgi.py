@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The availability event stream (library.views.availability_events) is an
+async streaming response that stays open while a user watches, which only
+an ASGI server can serve, so run the site through this module, e.g.
+``uvicorn Nexus.asgi:application``.
 """
 
 import os
@@ -14,3 +19,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Nexus.settings')
 
 application = get_asgi_application()
+
+# Fill this worker's in-process caches (typeahead index, templates) before it
+# takes traffic; `manage.py warm_caches` only fills the shared cache.
+from library.warmup import warm_worker  # noqa: E402
+
+warm_worker()
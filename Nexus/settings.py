@@ -42,10 +42,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'library.middleware.GZipMiddleware',
+    'library.middleware.PrecompressedStaticMiddleware',
+    'library.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'library.middleware.RateLimitMiddleware',
+    'library.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,9 +84,143 @@ LOGOUT_REDIRECT_URL = '/login/'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # Stock sqlite3 backend plus WAL/busy_timeout pragmas, see library/backends/sqlite3
+        'ENGINE': 'library.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # Reuse connections across requests instead of reconnecting every time
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock at BEGIN so busy_timeout applies, instead of
+            # failing when a read transaction later tries to upgrade to a write
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'busy_timeout': 5000,
+            },
+        },
+    },
+    # Read-only copy of default for analytics/reporting reads, refreshed with
+    # `manage.py refresh_replica --interval 60`. See library/routers.py
+    'replica': {
+        'ENGINE': 'library.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pragmas': {
+                'query_only': 'ON',
+            },
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['library.routers.BranchRouter', 'library.routers.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+# Branch code -> database alias for branches whose inventory (BranchCopies)
+# lives in its own SQLite file, e.g. {'north': 'branch_north'} with a
+# 'branch_north' entry in DATABASES; create its tables with
+# `manage.py migrate --database branch_north`. Other branches use default.
+BRANCH_DATABASES = {}
+# How long a user's reads stay on the primary after they write; should cover
+# at least one refresh_replica interval.
+REPLICA_PIN_SECONDS = 120
+
+
+# Caching
+# The shared tier is file based so all worker processes on a host see the
+# same entries; library.cache.TwoTierCache puts an in-process LRU in front.
+# It holds sessions, users and user types (a few entries per active user),
+# tag versions and the catalog sections. Once MAX_ENTRIES is reached every
+# set() deletes a random 1/CULL_FREQUENCY of all entries, so keep it well
+# above the working set.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+    # Rate-limit buckets (RATE_LIMIT_CACHE), kept apart so culling the
+    # shared tier can't reset them and they don't crowd it. This backend only
+    # ever deletes expired buckets, and is read directly, never through the
+    # in-process tier.
+    'ratelimit': {
+        'BACKEND': 'library.cache.ExpiringFileBasedCache',
+        'LOCATION': BASE_DIR / '.cache-ratelimit',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# Upper bound on how long an entry lives in a worker's in-process tier, which
+# other workers can't invalidate (e.g. a logout or password change elsewhere)
+LOCAL_CACHE_TIMEOUT = 10
+# Resolved User objects and user types, dropped on save via library.signals
+CACHED_USER_TIMEOUT = 60
+# Genre list and the home page's global sections (trending, analytics), which
+# `manage.py warm_caches` precomputes after a deploy
+CATALOG_CACHE_TIMEOUT = 300
+# library.cache.TwoTierCache.get_or_set(): how long an expired value may still
+# be served while it is refreshed in the background, and how long one caller
+# may hold the recompute lock before others give up waiting and compute too
+CACHE_STALE_TIMEOUT = 60
+CACHE_LOCK_TIMEOUT = 10
+
+# Returned loans older than this move to BorrowingHistoryArchive when
+# `manage.py archive_loans` runs
+LOAN_ARCHIVE_AFTER_DAYS = 365
+
+SESSION_ENGINE = 'library.sessions'
+AUTHENTICATION_BACKENDS = ['library.auth.CachedModelBackend']
+
+
+# Search result pages with more rows than this are streamed in chunks
+STREAM_RESULTS_THRESHOLD = 200
+
+# Per-process memory for cached search results (library.search.search_cache)
+SEARCH_CACHE_BYTES = 16 * 1024 * 1024
+
+# Similar items stored per item by `manage.py build_similar_items`
+SIMILAR_ITEMS_K = 10
+
+# Server-sent availability events (library.events). Only enable them when
+# serving through Nexus.asgi: each open stream holds a connection for as long
+# as the page is open, which under WSGI is a whole worker thread.
+SSE_ENABLED = False
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_WATCHED_BOOKS = 200
+
+# Admission control (library.middleware.RateLimitMiddleware), by URL name.
+# user_rate/global_rate are tokens per second, *_burst the bucket sizes and
+# concurrency the requests in flight across all workers, split evenly between
+# the RATE_LIMIT_WORKERS worker processes on a host (at least one each).
+RATE_LIMIT_CACHE = 'ratelimit'
+RATE_LIMIT_WORKERS = 2
+RATE_LIMITS = {
+    'borrow_item': {'user_rate': 0.2, 'user_burst': 5, 'global_rate': 20, 'global_burst': 40, 'concurrency': 4},
+    'borrow_batch': {'user_rate': 0.1, 'user_burst': 2, 'global_rate': 5, 'global_burst': 10, 'concurrency': 2},
+    'reserve_book': {'user_rate': 0.2, 'user_burst': 5, 'global_rate': 20, 'global_burst': 40, 'concurrency': 4},
+    'search_items': {'user_rate': 1, 'user_burst': 10, 'global_rate': 50, 'global_burst': 100, 'concurrency': 8},
+}
+
+# Request profiling (library.middleware.ProfilingMiddleware), off by default.
+# Profiles SAMPLE_RATE of all requests plus staff requests sending HEADER;
+# `manage.py profile_report` aggregates what ends up in OUTPUT_DIR.
+PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.0,
+    'HEADER': 'X-Profile',
+    'INTERVAL': 0.001,  # seconds between stack samples
+    'OUTPUT_DIR': BASE_DIR / 'profiles',
 }
 
 
@@ -121,6 +260,20 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'library' / 'static']
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed names plus .gz/.br siblings into
+# STATIC_ROOT, which PrecompressedStaticMiddleware serves with far-future
+# cache headers. With DEBUG on, or before collectstatic has run, {% static %}
+# keeps the plain names.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'library.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -134,6 +287,16 @@ EMAIL_HOST_USER = 'dppandya0918@gmail.com' #sender
 EMAIL_HOST_PASSWORD = 'nrsw mgrm knyy pkyh'  
 DEFAULT_FROM_EMAIL = 'Nexus Library <noreply@nexuslibrary.com>'  
 
+# `manage.py send_due_reminders`: remind this many days before the due date,
+# sending at most DUE_REMINDER_RATE emails per second (0 for no limit)
+DUE_REMINDER_DAYS = 2
+DUE_REMINDER_RATE = 0
+
+# Users whose fines reach this many rupees can't borrow; None disables the
+# block. UserLoanState.outstanding_fines is every fine ever charged, as
+# nothing records payments or waivers yet, so keep this off until it does.
+FINE_BORROW_LIMIT = None
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 SESSION_COOKIE_SECURE = False
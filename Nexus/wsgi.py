@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Nexus.settings')
 
 application = get_wsgi_application()
+
+# Fill this worker's in-process caches (typeahead index, templates) before it
+# takes traffic; `manage.py warm_caches` only fills the shared cache.
+from library.warmup import warm_worker  # noqa: E402
+
+warm_worker()
@@ -1,39 +1,117 @@
 from django.contrib import admin
-from .models import EBook, PrintedBook, ResearchPaper, Audiobook, BorrowingHistory, StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import EBook, PrintedBook, ResearchPaper, Audiobook, BorrowingHistory, BorrowingHistoryArchive, BookReservation, Branch, UserLoanState, StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile
+from .routers import replica_reads
+
+class EstimatedCountPaginator(Paginator):
+    # An exact COUNT(*) scans the whole table. When the changelist isn't
+    # filtered, use the row count SQLite's ANALYZE records in sqlite_stat1
+    # instead (archive_loans refreshes it); without statistics, and for small
+    # tables and filtered lists, count exactly. The estimate goes stale as
+    # rows come and go, so reaching its last page switches to the exact count.
+    estimate_threshold = 100000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        estimate = self.estimated_count()
+        if estimate is not None and estimate >= self.estimate_threshold:
+            self.estimated = True
+            return estimate
+        return super().count
+
+    def estimated_count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'sqlite':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [queryset.model._meta.db_table])
+            # Each index's stat starts with the number of rows in the table
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall() if stat]
+        return max(counts, default=None)
+
+    def page(self, number):
+        page = super().page(number)
+        if self.estimated and (not page.has_next() or len(page) < self.per_page):
+            # At the estimated end of the list, or already past the real one
+            self.estimated = False
+            self.__dict__['count'] = self.object_list.count()
+            self.__dict__.pop('num_pages', None)
+            page = super().page(number)
+        return page
+
+class LargeTableAdminMixin:
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) the changelist runs when filtered
+    show_full_result_count = False
+
+class ReplicaChangelistMixin:
+    # Changelists are reporting reads; serve plain GETs from the replica.
+    # POSTs (bulk actions, list_editable) stay on the primary.
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with replica_reads():
+            response = super().changelist_view(request, extra_context)
+            # Render now so the changelist queries run inside the block
+            if hasattr(response, 'render'):
+                response.render()
+        return response
 
 @admin.register(EBook)
-class EBookAdmin(admin.ModelAdmin):
+class EBookAdmin(ReplicaChangelistMixin, LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'author', 'genre', 'publication_date', 'file_url', 'file_size')
     search_fields = ('title', 'author', 'genre')
     list_filter = ('genre', 'publication_date')
 
 @admin.register(PrintedBook)
-class PrintedBookAdmin(admin.ModelAdmin):
+class PrintedBookAdmin(ReplicaChangelistMixin, LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'author', 'genre', 'publication_date', 'isbn', 'copies_available')
     search_fields = ('title', 'author', 'genre', 'isbn')
     list_filter = ('genre', 'publication_date')
 
 @admin.register(ResearchPaper)
-class ResearchPaperAdmin(admin.ModelAdmin):
+class ResearchPaperAdmin(ReplicaChangelistMixin, LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'author', 'genre', 'publication_date', 'doi', 'access_level')
     search_fields = ('title', 'author', 'genre', 'doi')
     list_filter = ('genre', 'publication_date', 'access_level')
 
 @admin.register(Audiobook)
-class AudiobookAdmin(admin.ModelAdmin):
+class AudiobookAdmin(ReplicaChangelistMixin, LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'author', 'genre', 'publication_date', 'duration', 'narrator')
     search_fields = ('title', 'author', 'genre', 'narrator')
     list_filter = ('genre', 'publication_date')
 
 @admin.register(BorrowingHistory)
-class BorrowingHistoryAdmin(admin.ModelAdmin):
-    list_display = ('user', 'item_title', 'borrow_date', 'due_date', 'return_date', 'fine')
-    search_fields = ('user__username',)
-    list_filter = ('borrow_date', 'due_date', 'return_date')
+class BorrowingHistoryAdmin(ReplicaChangelistMixin, LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'item_title', 'item_type', 'borrow_date', 'due_date', 'return_date', 'fine')
+    list_select_related = ('user',)
+    search_fields = ('user__username', 'item_title')
+    list_filter = ('item_type', 'borrow_date', 'due_date', 'return_date')
+    date_hierarchy = 'borrow_date'
+    autocomplete_fields = ('user',)
+
+@admin.register(BorrowingHistoryArchive)
+class BorrowingHistoryArchiveAdmin(BorrowingHistoryAdmin):
+    list_display = ('user', 'item_title', 'borrow_date', 'return_date', 'fine', 'archived_on')
+    list_filter = ('return_date', 'archived_on')
 
-    def item_title(self, obj):
-        return obj.item.title if obj.item else "N/A"
-    item_title.short_description = "Item Title"
+@admin.register(BookReservation)
+class BookReservationAdmin(ReplicaChangelistMixin, LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'printed_book', 'reservation_date', 'is_active', 'notified')
+    list_select_related = ('user', 'printed_book')
+    search_fields = ('user__username', 'printed_book__title')
+    list_filter = ('is_active', 'notified')
+    date_hierarchy = 'reservation_date'
+    autocomplete_fields = ('user', 'printed_book')
 
 @admin.register(StudentProfile)
 class StudentProfileAdmin(admin.ModelAdmin):
@@ -53,4 +131,17 @@ class FacultyProfileAdmin(admin.ModelAdmin):
 @admin.register(GuestProfile)
 class GuestProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'user_type')
-    search_fields = ('user__username',)
\ No newline at end of file
+    search_fields = ('user__username',)
+
+@admin.register(UserLoanState)
+class UserLoanStateAdmin(admin.ModelAdmin):
+    list_display = ('user', 'active_loans', 'overdue_loans', 'lifetime_loans', 'borrowing_limit', 'outstanding_fines')
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    autocomplete_fields = ('user',)
+
+@admin.register(Branch)
+class BranchAdmin(admin.ModelAdmin):
+    # Shelf counts live in the branch databases; see `manage.py branch_inventory`
+    list_display = ('code', 'name')
+    search_fields = ('code', 'name')
@@ -0,0 +1,30 @@
+import copy
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+from library.cache import two_tier_cache
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose per-request ``get_user`` is served from the two-tier cache.
+
+    Entries live for CACHED_USER_TIMEOUT seconds and are dropped whenever the
+    user is saved (password, permissions, is_active...), see library.signals.
+    """
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = two_tier_cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                two_tier_cache.set(key, user, getattr(settings, 'CACHED_USER_TIMEOUT', 60))
+            return user
+        # The local tier hands out the same instance; don't let one request's
+        # cached relations or edits leak into another.
+        return copy.deepcopy(user)
@@ -0,0 +1,36 @@
+from django.db.backends.sqlite3 import base as sqlite3_base
+
+# Applied to every new connection. WAL lets readers keep going while a
+# borrow/return holds the write lock, and busy_timeout makes writers wait
+# for the lock instead of failing straight away with "database is locked".
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # ms
+    'mmap_size': 134217728,  # 128 MB
+    'cache_size': -20000,  # negative means KiB, so ~20 MB
+    'temp_store': 'MEMORY',
+}
+
+
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class DatabaseWrapper(sqlite3_base.DatabaseWrapper):
+    """SQLite backend that tunes each connection for concurrent readers and writers.
+
+    Extra pragmas can be given (or defaults overridden) with
+    ``OPTIONS['pragmas']`` in ``settings.DATABASES``.
+    """
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {})}
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        apply_pragmas(conn, self.pragmas)
+        return conn
@@ -0,0 +1,132 @@
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+from django.db.models import F
+
+from library.models import Branch, BranchCopies
+from library.routers import branch_alias, inventory_aliases
+from library.transactions import atomic_with_retry
+
+
+def _take_copies(branch_code, book_ids):
+    # One statement for the whole batch; RETURNING says which books the shelf had a copy of
+    alias = branch_alias(branch_code)
+    quote = connections[alias].ops.quote_name
+    placeholders = ', '.join(['%s'] * len(book_ids))
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {quote(BranchCopies._meta.db_table)} SET copies_available = copies_available - 1 "
+            f"WHERE branch_id = %s AND copies_available > 0 AND printed_book_id IN ({placeholders}) "
+            "RETURNING printed_book_id",
+            [branch_code, *book_ids],
+        )
+        return {book_id for book_id, in cursor.fetchall()}
+
+
+def _put_back(branch_code, counts):
+    by_count = defaultdict(list)
+    for book_id, count in counts.items():
+        by_count[count].append(book_id)
+    for count, book_ids in by_count.items():
+        BranchCopies.objects.using(branch_alias(branch_code)).filter(
+            branch_id=branch_code, printed_book_id__in=book_ids,
+        ).update(copies_available=F('copies_available') + count)
+
+
+def take_copies(branch, book_ids):
+    """Take a copy of each of ``book_ids`` off ``branch``'s shelf; return the ids it had a copy of."""
+    if not book_ids:
+        return set()
+    return atomic_with_retry(_take_copies, using=branch_alias(branch.code))(branch.code, list(book_ids))
+
+
+def take_copy(branch, book_id):
+    """Take a copy of a printed book off ``branch``'s shelf; False if it has none."""
+    return book_id in take_copies(branch, [book_id])
+
+
+def take_any_copies(book_ids):
+    """Take a copy of each printed book off the first shelf, by branch name, that has one.
+
+    Returns ``{book_id: branch}`` for the books a shelf had a copy of; any
+    copies the other books have left are on no shelf. Each branch gets one
+    statement for all the books it is asked for, whatever their number.
+    """
+    shelves = {
+        book_id: [Branch(code=code, name=name) for code, name, copies in rows if copies > 0]
+        for book_id, rows in branch_copies(book_ids).items()
+    }
+    candidates = {book_id: branches for book_id, branches in shelves.items() if branches}
+    taken = {}
+    # A shelf emptied since it was read sends its books on to their next shelf
+    while candidates:
+        by_branch = defaultdict(list)
+        for book_id, branches in candidates.items():
+            by_branch[branches[0]].append(book_id)
+        for branch, ids in by_branch.items():
+            for book_id in take_copies(branch, ids):
+                taken[book_id] = branch
+        candidates = {
+            book_id: branches[1:] for book_id, branches in candidates.items()
+            if book_id not in taken and len(branches) > 1
+        }
+    return taken
+
+
+def take_any_copy(book_id):
+    """``take_any_copies()`` for one book: the branch its copy came off, or None."""
+    return take_any_copies([book_id]).get(book_id)
+
+
+def put_back(branch_code, book_id):
+    """Put a copy back on ``branch_code``'s shelf, retrying while its database is busy."""
+    put_back_all([(branch_code, book_id)])
+
+
+def put_back_all(copies):
+    """``put_back()`` each ``(branch_code, book_id)``, in one transaction per branch."""
+    by_branch = defaultdict(Counter)
+    for branch_code, book_id in copies:
+        by_branch[branch_code][book_id] += 1
+    for branch_code, counts in by_branch.items():
+        atomic_with_retry(_put_back, using=branch_alias(branch_code))(branch_code, counts)
+
+
+def _read_copies(alias, book_ids):
+    return list(
+        BranchCopies.objects.using(alias).filter(printed_book_id__in=book_ids)
+        .values_list('printed_book_id', 'branch_id', 'copies_available')
+    )
+
+
+def _read_copies_in_thread(alias, book_ids):
+    try:
+        return _read_copies(alias, book_ids)
+    finally:
+        # Pool threads have their own connections
+        connections.close_all()
+
+
+def branch_copies(book_ids):
+    """``{book_id: [(branch_code, branch_name, copies), ...]}`` for the given printed books, by branch name.
+
+    Every branch database is read in parallel and the rows merged, so a
+    branch busy with writes only delays its own part of the answer.
+    """
+    if not book_ids:
+        return {}
+    names = dict(Branch.objects.values_list('code', 'name'))
+    if not names:
+        return {}
+    aliases = inventory_aliases()
+    if len(aliases) == 1:
+        rows = _read_copies(aliases[0], book_ids)
+    else:
+        with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+            rows = [row for part in pool.map(lambda alias: _read_copies_in_thread(alias, book_ids), aliases) for row in part]
+    copies = {}
+    for book_id, branch_code, count in rows:
+        if branch_code in names:
+            copies.setdefault(book_id, []).append((branch_code, names[branch_code], count))
+    return {book_id: sorted(counts, key=lambda row: row[1]) for book_id, counts in copies.items()}
@@ -0,0 +1,358 @@
+import logging
+import math
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+# What get_or_set() stores: ``expires`` is a wall-clock time, ``delta`` how
+# long the value took to compute and ``tags`` the tag versions it was built at.
+CacheEntry = namedtuple('CacheEntry', ['value', 'expires', 'delta', 'tags'])
+
+
+class LocalLRUCache:
+    """Small thread-safe in-process LRU cache with per-entry expiry."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SizedLRUCache:
+    """Thread-safe in-process LRU bounded by the total size of its values.
+
+    Sizes come from ``sizeof`` (``sys.getsizeof`` by default, which is exact
+    for flat values such as ``array`` or ``bytes``). Entries don't expire;
+    put a version in the key to retire them.
+    """
+
+    def __init__(self, max_bytes, sizeof=sys.getsizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._data[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+
+class CacheMetrics:
+    """Per-process hit/miss counters for TwoTierCache.get_or_set()."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+class ExpiringFileBasedCache(FileBasedCache):
+    """FileBasedCache that makes room by deleting expired entries, never live ones.
+
+    The stock backend deletes a random 1/CULL_FREQUENCY of all entries once
+    MAX_ENTRIES is reached. For rate-limit buckets that hands some clients a
+    full bucket again. Buckets expire within a minute of a client's last
+    request, so dropping expired files keeps the directory near the number
+    of active clients; past MAX_ENTRIES of live ones it simply grows.
+    """
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        for fname in filelist:
+            try:
+                with open(fname, 'rb') as f:
+                    # Deletes the file when it has expired
+                    self._is_expired(f)
+            except FileNotFoundError:
+                pass
+
+
+class TwoTierCache:
+    """In-process LRU in front of a shared Django cache.
+
+    Reads hit the local tier first. Deletes only reach the local tier of the
+    current process, so entries there live for at most ``local_timeout``
+    seconds; that bounds how stale another worker's copy can get.
+
+    ``get_or_set()`` adds stampede protection on top: one caller recomputes a
+    missing value while the others wait for it, expired values are served
+    for up to ``stale_timeout`` more seconds while one caller refreshes them
+    in the background, values are refreshed a little early at random (more
+    likely the slower they are to compute), and entries built before one of
+    their tags was bumped with ``bump_tag()`` are treated as missing.
+    """
+
+    def __init__(self, alias='default', local_timeout=None, max_entries=10000):
+        self.alias = alias
+        self.local = LocalLRUCache(max_entries)
+        self._local_timeout = local_timeout
+        self.metrics = CacheMetrics()
+        self._key_locks = [threading.Lock() for _ in range(64)]
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    @property
+    def local_timeout(self):
+        if self._local_timeout is not None:
+            return self._local_timeout
+        return getattr(settings, 'LOCAL_CACHE_TIMEOUT', 10)
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+        value = self.shared.get(key, MISSING)
+        if value is MISSING:
+            return default
+        self.local.set(key, value, self.local_timeout)
+        return value
+
+    def set(self, key, value, timeout):
+        self.shared.set(key, value, timeout)
+        self.local.set(key, value, min(timeout, self.local_timeout))
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def get_or_set(self, key, compute, timeout, tags=(), stale_timeout=None, beta=1.0, force=False):
+        """Return the cached value for ``key``, calling ``compute()`` when it has to be (re)built."""
+        if stale_timeout is None:
+            stale_timeout = getattr(settings, 'CACHE_STALE_TIMEOUT', 60)
+        versions = self.tag_versions(tags)
+        entry = None if force else self._get_entry(key, versions)
+        if entry is not None:
+            now = time.time()
+            # Probabilistic early expiry ("XFetch"): -log(u) is usually small
+            # but occasionally large, so one caller refreshes slightly early
+            early = now - entry.delta * beta * math.log(1.0 - random.random()) >= entry.expires
+            if now < entry.expires and not early:
+                return entry.value
+            if now < entry.expires + stale_timeout:
+                if self._acquire(key):
+                    self.metrics.incr('early_refreshes' if now < entry.expires else 'stale_served')
+                    self._refresh_in_background(key, compute, timeout, versions, stale_timeout)
+                return entry.value
+        return self._compute_once(key, compute, timeout, versions, stale_timeout, force)
+
+    def tag_versions(self, tags, shared=False):
+        """The current version of each tag.
+
+        With ``shared`` the versions are read from the shared tier, so a bump
+        made by another worker is seen at once rather than up to
+        ``local_timeout`` seconds later; use it where staleness is visible,
+        e.g. for HTTP validators.
+        """
+        return tuple(self._tag_version(tag, shared) for tag in tags)
+
+    def bump_tag(self, tag):
+        # A fresh timestamp rather than a counter, so a version that got
+        # evicted from the shared cache can never come back with an old value
+        key = self._tag_key(tag)
+        version = time.time_ns()
+        self.shared.set(key, version, None)
+        self.local.set(key, version, self.local_timeout)
+
+    def stats(self):
+        return self.metrics.snapshot()
+
+    def _tag_key(self, tag):
+        return f'cache_tag:{tag}'
+
+    def _tag_version(self, tag, shared=False):
+        key = self._tag_key(tag)
+        version = MISSING if shared else self.local.get(key)
+        if version is MISSING:
+            version = self.shared.get(key)
+            if version is None:
+                self.shared.add(key, time.time_ns(), None)
+                version = self.shared.get(key, 0)
+            self.local.set(key, version, self.local_timeout)
+        return version
+
+    def _get_entry(self, key, versions, count=True):
+        incr = self.metrics.incr if count else lambda name: None
+        entry = self.local.get(key)
+        if entry is not MISSING:
+            incr('local_hits')
+        else:
+            entry = self.shared.get(key)
+            if entry is None:
+                incr('misses')
+                return None
+            incr('shared_hits')
+            self.local.set(key, entry, self.local_timeout)
+        if not isinstance(entry, CacheEntry) or entry.tags != versions:
+            incr('invalidated')
+            return None
+        return entry
+
+    def _store(self, key, compute, timeout, versions, stale_timeout):
+        timeout = timeout() if callable(timeout) else timeout
+        start = time.monotonic()
+        value = compute()
+        self.metrics.incr('recomputes')
+        # Tagged with the versions read before computing: a bump that lands
+        # mid-computation leaves this entry already invalid
+        entry = CacheEntry(value, time.time() + timeout, time.monotonic() - start, versions)
+        self.shared.set(key, entry, timeout + stale_timeout)
+        self.local.set(key, entry, min(timeout + stale_timeout, self.local_timeout))
+        return value
+
+    def _compute_once(self, key, compute, timeout, versions, stale_timeout, force):
+        # Threads of this process queue on a striped lock; other processes are
+        # kept out by a lock entry in the shared cache
+        with self._key_locks[hash(key) % len(self._key_locks)]:
+            if not force:
+                # Filled by another thread while this one waited for the lock?
+                entry = self._get_entry(key, versions, count=False)
+                if entry is not None and time.time() < entry.expires:
+                    return entry.value
+            acquired = self._acquire(key)
+            try:
+                if not acquired:
+                    self.metrics.incr('waits')
+                    value = self._wait_for(key, versions)
+                    if value is not MISSING:
+                        return value
+                return self._store(key, compute, timeout, versions, stale_timeout)
+            finally:
+                if acquired:
+                    self._release(key)
+
+    def _wait_for(self, key, versions):
+        deadline = time.monotonic() + getattr(settings, 'CACHE_LOCK_TIMEOUT', 10)
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = self.shared.get(key)
+            if entry is not None and entry.tags == versions and time.time() < entry.expires:
+                self.local.set(key, entry, self.local_timeout)
+                return entry.value
+            if self.shared.get(self._lock_key(key)) is None:
+                break
+        return MISSING
+
+    def _refresh_in_background(self, key, compute, timeout, versions, stale_timeout):
+        def refresh():
+            try:
+                self._store(key, compute, timeout, versions, stale_timeout)
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+            finally:
+                self._release(key)
+                # This thread's own database connections
+                connections.close_all()
+
+        threading.Thread(target=refresh, name=f'cache-refresh-{key}', daemon=True).start()
+
+    def _lock_key(self, key):
+        return f'lock:{key}'
+
+    def _acquire(self, key):
+        return self.shared.add(self._lock_key(key), 1, getattr(settings, 'CACHE_LOCK_TIMEOUT', 10))
+
+    def _release(self, key):
+        self.shared.delete(self._lock_key(key))
+
+
+two_tier_cache = TwoTierCache()
+
+
+def cached(key, timeout, tags=(), stale_timeout=None, cache=two_tier_cache):
+    """Cache a function's result with ``cache.get_or_set()``.
+
+    ``key`` is a string or a callable taking the function's arguments, and
+    ``timeout`` a number of seconds or a callable returning one. The wrapped
+    function takes an extra ``refresh=True`` to recompute unconditionally.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, refresh=False, **kwargs):
+            cache_key = key(*args, **kwargs) if callable(key) else key
+            return cache.get_or_set(
+                cache_key, lambda: func(*args, **kwargs), timeout,
+                tags=tags, stale_timeout=stale_timeout, force=refresh,
+            )
+        return wrapper
+    return decorator
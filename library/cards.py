@@ -0,0 +1,129 @@
+from library.models import EBook, PrintedBook, ResearchPaper, Audiobook, BorrowingHistory
+
+ITEM_MODELS = [EBook, PrintedBook, Audiobook, ResearchPaper]
+BOOK_TYPES = ('ebook', 'printedbook', 'audiobook')
+# Columns read for each book type, in ItemCard constructor order after ``type``
+CARD_FIELDS = {
+    'ebook': ('id', 'title', 'author', 'genre'),
+    'printedbook': ('id', 'title', 'author', 'genre', 'copies_available'),
+    'audiobook': ('id', 'title', 'author', 'genre'),
+}
+TYPE_NAMES = {model._meta.model_name: model.__name__ for model in ITEM_MODELS}
+
+
+class ItemCard:
+    """What a catalog list shows of an item, read with ``values_list()``.
+
+    Cards are shared through the cache, so a user's ``status`` goes on a copy
+    made by ``with_status()``; until then it is empty. ``branch_copies``
+    lists a printed book's ``(branch_code, branch_name, copies)`` where a
+    view sets it.
+    """
+
+    __slots__ = ('type', 'id', 'title', 'author', 'genre', 'copies_available', 'access_level', 'status',
+                 'branch_copies')
+
+    def __init__(self, type, id, title, author, genre, copies_available=None, access_level='', status=''):
+        self.type = type
+        self.id = id
+        self.title = title
+        self.author = author
+        self.genre = genre
+        self.copies_available = copies_available
+        self.access_level = access_level
+        self.status = status
+        self.branch_copies = None
+
+    def __repr__(self):
+        return f"<ItemCard {self.type} {self.id}: {self.title}>"
+
+    @property
+    def type_name(self):
+        return TYPE_NAMES[self.type]
+
+    @property
+    def is_book(self):
+        return self.type in BOOK_TYPES
+
+    @property
+    def is_research_paper(self):
+        return self.type == 'researchpaper'
+
+    def with_status(self, status):
+        return ItemCard(self.type, self.id, self.title, self.author, self.genre,
+                        self.copies_available, self.access_level, status)
+
+
+def cards_from_queryset(queryset):
+    """One ItemCard per row of ``queryset``, read with a single ``values_list()`` of the card columns."""
+    model = queryset.model
+    model_name = model._meta.model_name
+    if model is ResearchPaper:
+        rows = queryset.values_list('id', 'title', 'author', 'genre', 'access_level')
+        return [ItemCard(model_name, item_id, title, author, genre, None, access_level)
+                for item_id, title, author, genre, access_level in rows]
+    return [ItemCard(model_name, *row) for row in queryset.values_list(*CARD_FIELDS[model_name])]
+
+
+def load_cards(keys, models):
+    """Cards for ``(model_name, item_id)`` keys, one query per item type, in the order of ``keys``."""
+    models_by_name = {model._meta.model_name: model for model in models}
+    ids_by_name = {}
+    for model_name, item_id in keys:
+        if model_name in models_by_name:
+            ids_by_name.setdefault(model_name, []).append(item_id)
+    cards = {
+        (model_name, card.id): card
+        for model_name, ids in ids_by_name.items()
+        for card in cards_from_queryset(models_by_name[model_name].objects.filter(id__in=ids))
+    }
+    return [cards[key] for key in keys if key in cards]
+
+
+def with_current_copies(cards):
+    """Copies of ``cards`` with printed books' ``copies_available`` read now, in one query.
+
+    For cards cached under the catalog tag, which borrows and returns don't bump.
+    """
+    ids = [card.id for card in cards if card.type == 'printedbook']
+    if not ids:
+        return cards
+    copies = dict(PrintedBook.objects.filter(id__in=ids).values_list('id', 'copies_available'))
+    return [
+        ItemCard(card.type, card.id, card.title, card.author, card.genre,
+                 copies.get(card.id, card.copies_available), card.access_level, card.status)
+        if card.type == 'printedbook' else card
+        for card in cards
+    ]
+
+
+def open_loan_keys(user):
+    """``(model_name, item_id)`` of everything ``user`` has out, in one query."""
+    if not user.is_authenticated:
+        return set()
+    return set(
+        BorrowingHistory.objects.filter(user=user, return_date__isnull=True).values_list('item_type', 'object_id')
+    )
+
+
+def with_status(cards, user, borrowed=None):
+    """Copies of ``cards`` with the status the item has for ``user``.
+
+    Same rules as the ``get_item_status`` template filter, without a query
+    per item. Pass ``borrowed`` (from ``open_loan_keys()``) to share it
+    between lists on one page.
+    """
+    if not user.is_authenticated:
+        return [card.with_status('Unavailable') for card in cards]
+    if borrowed is None:
+        borrowed = open_loan_keys(user)
+    result = []
+    for card in cards:
+        if (card.type, card.id) in borrowed:
+            status = 'Borrowed'
+        elif card.type == 'printedbook' and card.copies_available <= 0:
+            status = 'Unavailable'
+        else:
+            status = 'Available'
+        result.append(card.with_status(status))
+    return result
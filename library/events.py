@@ -0,0 +1,127 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+from library.models import PrintedBook
+
+
+def heartbeat_seconds():
+    return getattr(settings, 'SSE_HEARTBEAT_SECONDS', 15)
+
+
+class Subscription:
+    """One stream's view of the hub: the latest copy count of each watched book that changed."""
+
+    def __init__(self, book_ids, loop):
+        self.book_ids = frozenset(book_ids)
+        self.loop = loop
+        self._pending = {}
+        self._changed = asyncio.Event()
+
+    def _push(self, book_id, copies):
+        # On the subscriber's loop. Only the latest count matters, so a slow
+        # client gets one update per book however many returns it missed.
+        self._pending[book_id] = copies
+        self._changed.set()
+
+    async def changes(self, timeout):
+        """Wait up to ``timeout`` seconds for changes; return them as ``{book_id: copies}``."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._changed.clear()
+        pending, self._pending = self._pending, {}
+        return pending
+
+
+def _push_all(subscriptions, book_id, copies):
+    for subscription in subscriptions:
+        subscription._push(book_id, copies)
+
+
+class AvailabilityHub:
+    """In-process pub/sub of printed book availability, for SSE streams.
+
+    Publishers are sync code on any thread (the on_commit hooks of
+    LibraryService's borrow and return methods); subscribers are async
+    streams, woken on their own event loop. Idle streams cost a dict entry
+    and a waiting task, and nothing polls the database. Only streams in the
+    process that made a change hear about it, so serve the event stream and
+    the borrow/return views from the same ASGI workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, book_ids):
+        subscription = Subscription(book_ids, asyncio.get_running_loop())
+        with self._lock:
+            for book_id in subscription.book_ids:
+                self._subscriptions[book_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for book_id in subscription.book_ids:
+                subscriptions = self._subscriptions.get(book_id)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self._subscriptions[book_id]
+
+    def watched(self, book_ids):
+        with self._lock:
+            return {book_id for book_id in book_ids if book_id in self._subscriptions}
+
+    def publish(self, book_id, copies):
+        by_loop = defaultdict(list)
+        with self._lock:
+            for subscription in self._subscriptions.get(book_id, ()):
+                by_loop[subscription.loop].append(subscription)
+        # One wakeup per event loop, not per stream
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_push_all, subscriptions, book_id, copies)
+            except RuntimeError:
+                # The loop has shut down; its streams are gone
+                for subscription in subscriptions:
+                    self.unsubscribe(subscription)
+
+    def publish_books(self, book_ids):
+        """Publish the current copy counts of the watched ones among ``book_ids``."""
+        watched = self.watched(book_ids)
+        if watched:
+            for book_id, copies in PrintedBook.objects.filter(id__in=watched).values_list('id', 'copies_available'):
+                self.publish(book_id, copies)
+
+
+availability_hub = AvailabilityHub()
+
+
+def availability_event(book_id, copies):
+    data = json.dumps({'book': book_id, 'copies': copies, 'available': copies > 0})
+    return f"event: availability\ndata: {data}\n\n"
+
+
+async def availability_stream(book_ids):
+    """Server-sent events with the copy counts of ``book_ids``: all of them first, then each change."""
+    subscription = availability_hub.subscribe(book_ids)
+    try:
+        yield f"retry: {heartbeat_seconds() * 1000}\n\n"
+        # Read after subscribing, so a change in between is sent twice rather than missed
+        async for book_id, copies in PrintedBook.objects.filter(id__in=book_ids).values_list('id', 'copies_available'):
+            yield availability_event(book_id, copies)
+        while True:
+            changes = await subscription.changes(heartbeat_seconds())
+            if not changes:
+                # Keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            for book_id, copies in changes.items():
+                yield availability_event(book_id, copies)
+    finally:
+        availability_hub.unsubscribe(subscription)
@@ -0,0 +1,78 @@
+import contextlib
+import io
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from library.cache import two_tier_cache
+from library.models import StudentProfile
+from library.services import user_type_cache_key
+from library.sessions import local_sessions
+
+# Private to this run, so nothing lands in the shared cache, and no page
+# is throttled part-way through
+ISOLATED_SETTINGS = {
+    'CACHES': {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'auth-benchmark'},
+        'ratelimit': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'auth-benchmark-ratelimit'},
+    },
+    'RATE_LIMITS': {},
+}
+STOCK_SETTINGS = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+}
+PAGES = ['/profile/', '/history/', '/search/', '/explore/']
+
+
+class Command(BaseCommand):
+    help = (
+        "Count queries per authenticated page with the stock session/auth setup and "
+        "with the cached one. Runs against throwaway test databases and a private "
+        "cache, like the test suite, so the real ones are never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5, help="Requests per page.")
+
+    def handle(self, *args, **options):
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            with override_settings(**ISOLATED_SETTINGS):
+                user = User.objects.create_user('auth-benchmark-user', password='unused')
+                StudentProfile.objects.create(user=user, user_type='Student')
+                with override_settings(**STOCK_SETTINGS):
+                    stock = self.measure(user, options['requests'], cached=False)
+                cached = self.measure(user, options['requests'], cached=True)
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+            # Test-database ids mean nothing outside this run
+            two_tier_cache.local.clear()
+            local_sessions.clear()
+
+        self.stdout.write(f"{'page':<12} {'stock':>8} {'cached':>8}   (queries per request)")
+        for page in PAGES:
+            self.stdout.write(f"{page:<12} {stock[page]:>8.1f} {cached[page]:>8.1f}")
+
+    def measure(self, user, requests, cached):
+        client = Client()
+        client.force_login(user)
+        client.get(PAGES[0])  # warm caches; the first request always misses
+        averages = {}
+        for page in PAGES:
+            with CaptureQueriesContext(connection) as queries, contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(requests):
+                    if not cached:
+                        # Stock setup: the user type is looked up on every request
+                        two_tier_cache.delete(user_type_cache_key(user.pk))
+                    client.get(page)
+            averages[page] = len(queries) / requests
+        client.logout()
+        return averages
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+
+from library.models import Branch, BranchCopies, PrintedBook
+from library.routers import branch_alias
+from library.services import CIRCULATION_TAG, bump_tags_on_commit
+
+
+class Command(BaseCommand):
+    help = (
+        "Show or set a branch's shelf counts of printed books. Each change moves the "
+        "book's total copies_available by the same amount."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('branch', help="Branch code.")
+        parser.add_argument('copies', nargs='*', metavar='BOOK_ID=COPIES',
+                            help="Shelf counts to set. Without any, print the branch's inventory.")
+        parser.add_argument('--name', help="Create the branch with this name if it doesn't exist.")
+
+    def handle(self, *args, **options):
+        code = options['branch']
+        if options['name']:
+            branch, _ = Branch.objects.get_or_create(code=code, defaults={'name': options['name']})
+        else:
+            branch = Branch.objects.filter(code=code).first()
+            if branch is None:
+                raise CommandError(f"No branch '{code}'; pass --name to create it.")
+        alias = branch_alias(branch.code)
+
+        if not options['copies']:
+            rows = BranchCopies.objects.using(alias).filter(branch=branch)
+            copies = rows.aggregate(total=Sum('copies_available'))['total'] or 0
+            self.stdout.write(f"{branch.name} ({alias}): {rows.count()} books, {copies} copies on the shelf.")
+            return
+
+        try:
+            wanted = {int(book): int(copies) for book, copies in (pair.split('=', 1) for pair in options['copies'])}
+        except ValueError:
+            raise CommandError("Give shelf counts as BOOK_ID=COPIES.")
+        if negative := sorted(book for book, copies in wanted.items() if copies < 0):
+            raise CommandError(f"Shelf counts can't be negative (books {negative}).")
+        known = set(PrintedBook.objects.filter(id__in=wanted).values_list('id', flat=True))
+        if missing := set(wanted) - known:
+            raise CommandError(f"No printed books with ids {sorted(missing)}.")
+
+        for book_id, copies in wanted.items():
+            with transaction.atomic(using=alias):
+                row, _ = BranchCopies.objects.using(alias).get_or_create(branch=branch, printed_book_id=book_id)
+                change = copies - row.copies_available
+                row.copies_available = copies
+                row.save(using=alias, update_fields=['copies_available'])
+            with transaction.atomic():
+                PrintedBook.objects.filter(id=book_id).update(
+                    copies_available=Greatest(F('copies_available') + change, 0)
+                )
+                bump_tags_on_commit(CIRCULATION_TAG)
+            self.stdout.write(f"Book {book_id}: {copies} at {branch.name} ({change:+d}).")
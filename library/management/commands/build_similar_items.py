@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library import similarity
+from library.models import SimilarItems
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild every item's list of similar items from TF-IDF vectors over its title, "
+        "author, genre and type-specific fields. Run it nightly or after catalog imports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=None,
+                            help="Similar items stored per item (default: SIMILAR_ITEMS_K).")
+        parser.add_argument('--memory', type=int, default=64,
+                            help="MB of working memory for the similarity blocks.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows per INSERT.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Compute the similar items without storing them.")
+
+    def handle(self, *args, **options):
+        k = options['top_k'] or getattr(settings, 'SIMILAR_ITEMS_K', 10)
+        start = time.monotonic()
+        rows = similarity.build_similar_items(k, options['memory'] * 1024 * 1024)
+        engine = 'NumPy' if similarity.np is not None else 'pure Python'
+        self.stdout.write(f"Computed similar items for {len(rows)} items in {time.monotonic() - start:.1f}s ({engine}).")
+        if options['dry_run']:
+            return
+
+        # Readers keep seeing the previous lists until the swap commits
+        with transaction.atomic():
+            SimilarItems.objects.all().delete()
+            SimilarItems.objects.bulk_create(rows, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {len(rows)} lists in {time.monotonic() - start:.1f}s."))
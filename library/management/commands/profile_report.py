@@ -0,0 +1,89 @@
+import glob
+import json
+import os
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the profiles written by ProfilingMiddleware: the hottest frames by "
+        "self and total samples, and the slowest SQL statements. The .folded files can "
+        "also be opened directly in speedscope or fed to flamegraph.pl."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Profile directory (default: PROFILING['OUTPUT_DIR']).")
+        parser.add_argument('--view', help="Only include profiles of this view name.")
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--merge', metavar='PATH',
+                            help="Also write all matching stacks merged into one .folded file.")
+
+    def handle(self, *args, **options):
+        output_dir = options['dir'] or getattr(settings, 'PROFILING', {}).get('OUTPUT_DIR')
+        if not output_dir or not os.path.isdir(output_dir):
+            raise CommandError(f"No profile directory at {output_dir!r}.")
+        view_dir = options['view'] or '*'
+        folded_paths = sorted(glob.glob(os.path.join(output_dir, view_dir, '*.folded')))
+        if not folded_paths:
+            raise CommandError("No profiles found.")
+
+        stacks = Counter()
+        for path in folded_paths:
+            with open(path, encoding='utf-8') as folded:
+                for line in folded:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack:
+                        stacks[stack] += int(count)
+
+        queries = defaultdict(lambda: {'count': 0, 'seconds': 0.0})
+        wall_seconds = 0.0
+        for path in folded_paths:
+            try:
+                with open(path[:-len('.folded')] + '.sql.json', encoding='utf-8') as sidecar:
+                    data = json.load(sidecar)
+            except (OSError, ValueError):
+                continue
+            wall_seconds += data['wall_seconds']
+            for sql, stats in data['queries'].items():
+                queries[sql]['count'] += stats['count']
+                queries[sql]['seconds'] += stats['seconds']
+
+        top = options['top']
+        total_samples = sum(stacks.values())
+        self.stdout.write(
+            f"{len(folded_paths)} profiles, {total_samples} samples, {wall_seconds:.3f}s wall time"
+        )
+        self.report_frames(stacks, total_samples, top)
+        self.report_queries(queries, wall_seconds, top)
+
+        if options['merge']:
+            with open(options['merge'], 'w', encoding='utf-8') as merged:
+                for stack, count in stacks.most_common():
+                    merged.write(f"{stack} {count}\n")
+            self.stdout.write(f"Merged stacks written to {options['merge']}")
+
+    def report_frames(self, stacks, total_samples, top):
+        own, total = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            # Count recursive frames once per stack
+            for frame in set(frames):
+                total[frame] += count
+
+        for title, counter in (("Self samples", own), ("Total samples", total)):
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            for frame, count in counter.most_common(top):
+                self.stdout.write(f"  {count:>7} {100 * count / total_samples:>6.1f}%  {frame}")
+
+    def report_queries(self, queries, wall_seconds, top):
+        self.stdout.write(self.style.MIGRATE_HEADING("SQL by total time"))
+        ranked = sorted(queries.items(), key=lambda item: item[1]['seconds'], reverse=True)
+        for sql, stats in ranked[:top]:
+            share = 100 * stats['seconds'] / wall_seconds if wall_seconds else 0
+            self.stdout.write(
+                f"  {stats['seconds'] * 1000:>9.1f}ms {share:>6.1f}% {stats['count']:>6}x  {sql}"
+            )
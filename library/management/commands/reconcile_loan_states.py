@@ -0,0 +1,118 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from library.models import (
+    BorrowingHistory, BorrowingHistoryArchive, UserLoanState,
+    StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile,
+)
+from library.services import BORROWING_LIMITS
+from library.transactions import atomic_with_retry
+
+FIELDS = ('active_loans', 'outstanding_fines', 'borrowing_limit', 'lifetime_loans', 'overdue_loans')
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every user's loan state from BorrowingHistory and repair any drift. "
+        "Run it nightly: it is also what counts loans that have fallen overdue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report drift without changing anything.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Users counted and repaired per transaction.")
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        reconcile = self.reconcile_batch
+        if not options['dry_run']:
+            # Count and write each batch in one IMMEDIATE transaction, so no
+            # borrow or return can commit in between and have its +1/-1 undone
+            reconcile = atomic_with_retry(reconcile)
+
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+        created = updated = 0
+        for offset in range(0, len(user_ids), batch_size):
+            lines, batch_created, batch_updated = reconcile(
+                user_ids[offset:offset + batch_size], today, options['dry_run'],
+            )
+            for line in lines:
+                self.stdout.write(line)
+            created += batch_created
+            updated += batch_updated
+
+        verb = "Would repair" if options['dry_run'] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {updated} drifted and {created} missing loan states "
+            f"({len(user_ids)} users checked)."
+        ))
+
+    def reconcile_batch(self, user_ids, today, dry_run):
+        expected = self.expected_states(user_ids, today)
+        stored = {state.user_id: state for state in UserLoanState.objects.filter(user_id__in=user_ids)}
+
+        lines, to_create, to_update = [], [], []
+        for user_id, values in expected.items():
+            state = stored.get(user_id)
+            if state is None:
+                to_create.append(UserLoanState(user_id=user_id, overdue_as_of=today, **values))
+                continue
+            drift = {
+                field: (getattr(state, field), value)
+                for field, value in values.items()
+                if getattr(state, field) != value
+            }
+            if drift:
+                changes = ', '.join(f"{field} {old} -> {new}" for field, (old, new) in drift.items())
+                lines.append(f"User {user_id}: {changes}")
+                for field, value in values.items():
+                    setattr(state, field, value)
+                to_update.append(state)
+
+        if not dry_run:
+            UserLoanState.objects.bulk_create(to_create)
+            UserLoanState.objects.bulk_update(to_update, FIELDS)
+            # These states now count the loans overdue as of today
+            UserLoanState.objects.filter(user_id__in=user_ids).update(overdue_as_of=today)
+        return lines, len(to_create), len(to_update)
+
+    def expected_states(self, user_ids, today):
+        limits = {}
+        for profile_model in [StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile]:
+            for user_id, user_type in profile_model.objects.filter(user_id__in=user_ids).values_list('user_id', 'user_type'):
+                limits.setdefault(user_id, BORROWING_LIMITS.get(user_type, 0))
+
+        totals = {
+            row['user']: row
+            for row in BorrowingHistory.objects.filter(user_id__in=user_ids).values('user').annotate(
+                loans=Count('id'),
+                active=Count('id', filter=Q(return_date__isnull=True)),
+                overdue=Count('id', filter=Q(return_date__isnull=True, due_date__lt=today)),
+                fines=Sum('fine'),
+            )
+        }
+        # Archived loans are all returned, but they and their fines still count
+        archived = {
+            row['user']: row
+            for row in BorrowingHistoryArchive.objects.filter(user_id__in=user_ids).values('user')
+            .annotate(loans=Count('id'), fines=Sum('fine'))
+        }
+        expected = {}
+        for user_id in user_ids:
+            row = totals.get(user_id, {})
+            archived_row = archived.get(user_id, {})
+            fines = (row.get('fines') or 0) + (archived_row.get('fines') or 0)
+            expected[user_id] = {
+                'active_loans': row.get('active', 0),
+                'outstanding_fines': Decimal(fines).quantize(Decimal('0.01')),
+                'borrowing_limit': limits.get(user_id, 0),
+                'lifetime_loans': row.get('loans', 0) + archived_row.get('loans', 0),
+                'overdue_loans': row.get('overdue', 0),
+            }
+        return expected
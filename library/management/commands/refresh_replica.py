@@ -0,0 +1,45 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from library.routers import replica_alias
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database into the read replica with the online-backup API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep refreshing every N seconds. By default refresh once and exit.")
+        parser.add_argument('--pages', type=int, default=-1,
+                            help="Pages copied per backup step (-1 copies everything in one step).")
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias not in settings.DATABASES:
+            raise CommandError(f"No '{alias}' database is configured.")
+        source = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        target = connections[alias].settings_dict['NAME']
+
+        while True:
+            elapsed = self.refresh(source, target, options['pages'])
+            self.stdout.write(f"Replica refreshed in {elapsed:.2f}s")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def refresh(self, source, target, pages):
+        start = time.monotonic()
+        src = sqlite3.connect(source)
+        dst = sqlite3.connect(target)
+        try:
+            # Readers of the replica keep seeing the previous copy until the
+            # backup commits, and in WAL mode writers on the primary aren't blocked.
+            src.backup(dst, pages=pages)
+        finally:
+            dst.close()
+            src.close()
+        return time.monotonic() - start
@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.backends.sqlite3.base import DEFAULT_PRAGMAS, apply_pragmas
+from library.transactions import backoff_delays, is_busy_error
+
+PROFILES = ('default', 'tuned')
+
+SCHEMA = """
+CREATE TABLE item (id INTEGER PRIMARY KEY, copies_available INTEGER NOT NULL);
+CREATE TABLE loan (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    borrow_date REAL NOT NULL,
+    return_date REAL
+);
+CREATE INDEX loan_user_active ON loan (user_id, return_date);
+"""
+
+
+def connect(path, profile):
+    conn = sqlite3.connect(path, isolation_level=None)
+    if profile == 'tuned':
+        apply_pragmas(conn, DEFAULT_PRAGMAS)
+    else:
+        # Rollback journal, which is what the stock backend leaves in place
+        conn.execute("PRAGMA journal_mode = DELETE")
+    return conn
+
+
+def write_once(conn, user_id, item_id):
+    # Borrow if the user has nothing open on the item, otherwise return it,
+    # so the copy counter stays bounded for long runs.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT id FROM loan WHERE user_id = ? AND item_id = ? AND return_date IS NULL",
+            (user_id, item_id),
+        ).fetchone()
+        if row:
+            conn.execute("UPDATE loan SET return_date = ? WHERE id = ?", (time.time(), row[0]))
+            conn.execute("UPDATE item SET copies_available = copies_available + 1 WHERE id = ?", (item_id,))
+        else:
+            conn.execute(
+                "INSERT INTO loan (user_id, item_id, borrow_date) VALUES (?, ?, ?)",
+                (user_id, item_id, time.time()),
+            )
+            conn.execute("UPDATE item SET copies_available = copies_available - 1 WHERE id = ?", (item_id,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def read_once(conn, user_id):
+    conn.execute(
+        "SELECT COUNT(*) FROM loan WHERE user_id = ? AND return_date IS NULL", (user_id,)
+    ).fetchone()
+    conn.execute(
+        "SELECT item_id, COUNT(*) FROM loan GROUP BY item_id ORDER BY 2 DESC LIMIT 5"
+    ).fetchall()
+
+
+def worker(path, profile, role, seconds, users, items, results):
+    conn = connect(path, profile)
+    if profile == 'default':
+        # sqlite3.connect() waits 5s by default; disable it so the baseline
+        # shows how often writers actually collide.
+        conn.execute("PRAGMA busy_timeout = 0")
+    ops = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        user_id = random.randint(1, users)
+        delays = backoff_delays() if profile == 'tuned' else iter(())
+        while True:
+            try:
+                if role == 'writer':
+                    write_once(conn, user_id, random.randint(1, items))
+                else:
+                    read_once(conn, user_id)
+                ops += 1
+                break
+            except sqlite3.OperationalError as exc:
+                if not is_busy_error(exc):
+                    raise
+                delay = next(delays, None)
+                if delay is None:
+                    errors += 1
+                    break
+                time.sleep(delay)
+    conn.close()
+    results.put((role, ops, errors))
+
+
+class Command(BaseCommand):
+    help = "Measure SQLite throughput with concurrent reader and writer processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--items', type=int, default=2000)
+        parser.add_argument('--profile', choices=PROFILES, action='append',
+                            help="Profile to run (repeatable). Defaults to all profiles.")
+
+    def handle(self, *args, **options):
+        for profile in options['profile'] or PROFILES:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'bench.sqlite3')
+                self.prepare(path, profile, options['items'])
+                totals = self.run_profile(path, profile, options)
+            self.report(profile, totals, options['seconds'])
+
+    def prepare(self, path, profile, items):
+        conn = connect(path, profile)
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO item (id, copies_available) VALUES (?, ?)",
+            ((i, 1000) for i in range(1, items + 1)),
+        )
+        conn.close()
+
+    def run_profile(self, path, profile, options):
+        results = multiprocessing.Queue()
+        roles = ['reader'] * options['readers'] + ['writer'] * options['writers']
+        processes = [
+            multiprocessing.Process(
+                target=worker,
+                args=(path, profile, role, options['seconds'], options['users'], options['items'], results),
+            )
+            for role in roles
+        ]
+        for process in processes:
+            process.start()
+        totals = {'reader': [0, 0], 'writer': [0, 0]}
+        for _ in processes:
+            role, ops, errors = results.get()
+            totals[role][0] += ops
+            totals[role][1] += errors
+        for process in processes:
+            process.join()
+        return totals
+
+    def report(self, profile, totals, seconds):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Profile: {profile}"))
+        for role in ('reader', 'writer'):
+            ops, errors = totals[role]
+            self.stdout.write(
+                f"  {role + 's':<8} {ops / seconds:>10.1f} ops/s  {ops:>8} ok  {errors:>6} locked"
+            )
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.warmup import shared_stages, warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute the genre list and the home page's global sections in the shared "
+        "cache and page in the search index, so a new instance doesn't serve its first "
+        "users from a cold cache. Independent stages run in parallel. Per-process "
+        "caches (typeahead, templates) are warmed by each worker as it starts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', action='append', choices=shared_stages(),
+                            help="Stage to run (repeatable). Defaults to all shared stages.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Parallel stages (default: all at once).")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        results = warm_up(options['stage'] or shared_stages(), options['workers'])
+        elapsed = time.perf_counter() - start
+
+        failed = 0
+        for name, seconds, error in results:
+            if error is None:
+                self.stdout.write(f"  {name:<14} {seconds * 1000:>9.1f}ms")
+            else:
+                failed += 1
+                self.stderr.write(f"  {name:<14} {seconds * 1000:>9.1f}ms  failed: {error}")
+        self.stdout.write(f"Warmed {len(results) - failed}/{len(results)} stages in {elapsed * 1000:.1f}ms.")
+        if failed:
+            raise CommandError(f"{failed} stage(s) failed.")
@@ -0,0 +1,253 @@
+import gzip
+import math
+import mimetypes
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.db import connections
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.middleware.gzip import GZipMiddleware as BaseGZipMiddleware
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.utils.text import StreamingBuffer
+from django.views.static import was_modified_since
+
+from library import ratelimit
+from library.profiling import StackSampler
+from library.routers import track_request
+
+PIN_COOKIE = 'nexus_primary_pin'
+
+
+class ReplicaPinningMiddleware:
+    """Keep a user's reads on the primary until the replica has caught up with their writes."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track_request(pinned=PIN_COOKIE in request.COOKIES) as state:
+            response = self.get_response(request)
+        if state['wrote']:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+
+class PrecompressedStaticMiddleware:
+    """Serve files from STATIC_ROOT, preferring the .br/.gz siblings written by
+    ``CompressedManifestStaticFilesStorage`` when the client accepts them.
+
+    Content-hashed names never change content, so they are cached for a year;
+    anything else gets a short max-age.
+    """
+
+    encodings = [('br', '.br'), ('gzip', '.gz')]
+    hashed_name_re = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.root = settings.STATIC_ROOT
+
+    def __call__(self, request):
+        if self.root and request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        mtime = os.stat(path).st_mtime
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime):
+            response = HttpResponseNotModified()
+        else:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            accepted = {
+                token.split(';')[0].strip()
+                for token in request.headers.get('Accept-Encoding', '').split(',')
+            }
+            for encoding, suffix in self.encodings:
+                if encoding in accepted and os.path.isfile(path + suffix):
+                    response = FileResponse(open(path + suffix, 'rb'), content_type=content_type)
+                    response.headers['Content-Encoding'] = encoding
+                    break
+            else:
+                response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response.headers.pop('Content-Disposition', None)
+            response.headers['Last-Modified'] = http_date(mtime)
+
+        patch_vary_headers(response, ['Accept-Encoding'])
+        if self.hashed_name_re.search(name):
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response.headers['Cache-Control'] = 'public, max-age=60'
+        return response
+
+
+def compress_sequence_flushed(sequence, max_random_bytes=None):
+    """Like ``django.utils.text.compress_sequence()``, but flushes the gzip
+    stream after every item so each one reaches the client as it is produced.
+    """
+    buf = StreamingBuffer()
+    # Random-length filename in the header, as Django adds against BREACH
+    filename = b'a' * secrets.randbelow(max_random_bytes) if max_random_bytes else None
+    with gzip.GzipFile(filename=filename, mode='wb', compresslevel=6, fileobj=buf, mtime=0) as zfile:
+        for item in sequence:
+            zfile.write(item)
+            zfile.flush()
+            yield buf.read()
+    yield buf.read()
+
+
+class GZipMiddleware(BaseGZipMiddleware):
+    """Django's GZipMiddleware, flushing streamed responses chunk by chunk.
+
+    The stock middleware compresses a stream as one gzip member and only
+    emits output when zlib's buffer fills, so the first chunks of a streamed
+    page (e.g. the shell from ``library.responses.render_streaming()``) sat
+    in the buffer until enough rows followed. Flushing costs a little ratio
+    per chunk. Responses with a true ``gzip_exempt`` attribute (e.g. event
+    streams, whose events must reach the client as they are sent) are left
+    alone.
+    """
+
+    def process_response(self, request, response):
+        if getattr(response, 'gzip_exempt', False):
+            return response
+        if not response.streaming or response.is_async or response.has_header('Content-Encoding'):
+            return super().process_response(request, response)
+        original = response.streaming_content
+        response = super().process_response(request, response)
+        if response.get('Content-Encoding') == 'gzip':
+            response.streaming_content = compress_sequence_flushed(original, self.max_random_bytes)
+        return response
+
+
+class ProfilingMiddleware:
+    """Opt-in sampling profiler, configured by ``settings.PROFILING``.
+
+    Profiles a random SAMPLE_RATE fraction of requests, plus any request from
+    a staff user that carries the HEADER header. Each profile is written to
+    OUTPUT_DIR/<view name>/ as a collapsed-stack file (loadable in speedscope
+    or flamegraph.pl) with a JSON sidecar of SQL timings. Summarize them with
+    ``manage.py profile_report``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'PROFILING', {})
+        if not config.get('ENABLED'):
+            raise MiddlewareNotUsed
+        self.sample_rate = config.get('SAMPLE_RATE', 0.0)
+        header = config.get('HEADER')
+        self.header = 'HTTP_' + header.upper().replace('-', '_') if header else None
+        self.interval = config.get('INTERVAL', 0.001)
+        self.output_dir = config['OUTPUT_DIR']
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sampler.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            sampler.stop()
+        wall_seconds = time.perf_counter() - start
+
+        match = request.resolver_match
+        sampler.write(self.output_dir, match.view_name if match else 'unresolved', wall_seconds)
+        return response
+
+    def should_profile(self, request):
+        if self.header and self.header in request.META:
+            user = getattr(request, 'user', None)
+            return bool(user and user.is_staff)
+        return random.random() < self.sample_rate
+
+
+class RateLimitMiddleware:
+    """Admission control for the views listed in ``settings.RATE_LIMITS``.
+
+    Each entry, keyed by URL name, can set a per-user token bucket
+    (``user_rate`` tokens per second, up to ``user_burst``), a bucket shared
+    by everyone (``global_rate``/``global_burst``) and a cap on requests in
+    flight across all workers (``concurrency``). Buckets live in the
+    RATE_LIMIT_CACHE cache; the in-flight cap is split evenly between the
+    RATE_LIMIT_WORKERS worker processes, each counting its own requests
+    (see ``ratelimit.InFlightCounter``). Rejected requests get an immediate
+    429 (this user is over their rate) or 503 (the view is overloaded) with
+    Retry-After, rather than queueing for the SQLite write lock.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(settings, 'RATE_LIMITS', None):
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            slot = getattr(request, '_rate_limit_slot', None)
+            if slot is not None:
+                ratelimit.in_flight.leave(slot)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name
+        limits = ratelimit.limits_for(view_name)
+        if not limits:
+            return None
+        cache = ratelimit.limiter_cache()
+
+        if 'user_rate' in limits:
+            user = request.user
+            client = f'user:{user.pk}' if user.is_authenticated else f"ip:{request.META.get('REMOTE_ADDR')}"
+            wait = ratelimit.take_token(
+                cache, f'ratelimit:{view_name}:{client}', limits['user_rate'], limits.get('user_burst', 1),
+            )
+            if wait:
+                return self.reject(429, wait)
+        if 'global_rate' in limits:
+            wait = ratelimit.take_token(
+                cache, f'ratelimit:{view_name}', limits['global_rate'], limits.get('global_burst', 1),
+            )
+            if wait:
+                return self.reject(503, wait)
+        if 'concurrency' in limits:
+            slot = f'inflight:{view_name}'
+            if not ratelimit.in_flight.enter(slot, ratelimit.process_limit(limits['concurrency'])):
+                return self.reject(503, 1)
+            request._rate_limit_slot = slot
+        return None
+
+    def reject(self, status, wait):
+        message = "Too many requests" if status == 429 else "The library is busy"
+        response = HttpResponse(f"{message}, please try again shortly.", status=status, content_type='text/plain')
+        response['Retry-After'] = str(max(1, math.ceil(wait)))
+        return response
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('library', '0002_bookreservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='audiobook',
+            index=models.Index(fields=['genre'], name='library_aud_genre_9709db_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audiobook',
+            index=models.Index(fields=['publication_date'], name='library_aud_publica_f036bd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookreservation',
+            index=models.Index(fields=['reservation_date'], name='library_boo_reserva_24f768_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['borrow_date'], name='library_bor_borrow__74a912_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['due_date'], name='library_bor_due_dat_487cbe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['return_date'], name='library_bor_return__af0a63_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ebook',
+            index=models.Index(fields=['genre'], name='library_ebo_genre_08390e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ebook',
+            index=models.Index(fields=['publication_date'], name='library_ebo_publica_a93863_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printedbook',
+            index=models.Index(fields=['genre'], name='library_pri_genre_ad5ca6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printedbook',
+            index=models.Index(fields=['publication_date'], name='library_pri_publica_311353_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='researchpaper',
+            index=models.Index(fields=['genre'], name='library_res_genre_ccb4e2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='researchpaper',
+            index=models.Index(fields=['publication_date'], name='library_res_publica_7ccc6d_idx'),
+        ),
+    ]
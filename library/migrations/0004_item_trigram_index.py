@@ -0,0 +1,66 @@
+from django.db import migrations
+
+# FTS5 table with the trigram tokenizer over every item title and author,
+# used by library.search.fuzzy_keys. Rows are keyed by
+# rowid = item_id * 8 + type_code * 2 + field_code (see library.search), so
+# the triggers that keep it in sync can update a single item by rowid.
+ITEM_TABLES = {
+    'ebook': 0,
+    'printedbook': 1,
+    'researchpaper': 2,
+    'audiobook': 3,
+}
+
+
+def rowid(alias, type_code, field_code):
+    return f"{alias}.id * 8 + {type_code * 2 + field_code}"
+
+
+def forward_sql():
+    statements = [
+        "CREATE VIRTUAL TABLE library_itemtrigram USING fts5(text, tokenize='trigram')",
+        "CREATE VIRTUAL TABLE library_itemtrigram_vocab USING fts5vocab('library_itemtrigram', 'row')",
+    ]
+    for model_name, code in ITEM_TABLES.items():
+        table = f"library_{model_name}"
+        insert_rows = (
+            f"INSERT INTO library_itemtrigram (rowid, text) VALUES "
+            f"({rowid('new', code, 0)}, new.title), ({rowid('new', code, 1)}, new.author);"
+        )
+        delete_rows = (
+            f"DELETE FROM library_itemtrigram WHERE rowid IN "
+            f"({rowid('old', code, 0)}, {rowid('old', code, 1)});"
+        )
+        statements += [
+            f"INSERT INTO library_itemtrigram (rowid, text) "
+            f"SELECT {rowid(table, code, 0)}, title FROM {table} "
+            f"UNION ALL SELECT {rowid(table, code, 1)}, author FROM {table}",
+            f"CREATE TRIGGER {table}_trigram_ai AFTER INSERT ON {table} BEGIN {insert_rows} END",
+            f"CREATE TRIGGER {table}_trigram_au AFTER UPDATE OF title, author ON {table} "
+            f"BEGIN {delete_rows} {insert_rows} END",
+            f"CREATE TRIGGER {table}_trigram_ad AFTER DELETE ON {table} BEGIN {delete_rows} END",
+        ]
+    return statements
+
+
+def reverse_sql():
+    statements = []
+    for model_name in ITEM_TABLES:
+        for suffix in ('ai', 'au', 'ad'):
+            statements.append(f"DROP TRIGGER IF EXISTS library_{model_name}_trigram_{suffix}")
+    statements += [
+        "DROP TABLE IF EXISTS library_itemtrigram_vocab",
+        "DROP TABLE IF EXISTS library_itemtrigram",
+    ]
+    return statements
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(forward_sql(), reverse_sql()),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('library', '0004_item_trigram_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserLoanState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='loan_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('active_loans', models.PositiveIntegerField(default=0)),
+                ('outstanding_fines', models.DecimalField(decimal_places=2, default=0.0, max_digits=8)),
+                ('borrowing_limit', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
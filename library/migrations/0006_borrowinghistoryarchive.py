@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:28
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('library', '0005_userloanstate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BorrowingHistoryArchive',
+            fields=[
+                ('object_id', models.PositiveIntegerField()),
+                ('borrow_date', models.DateField(default=datetime.date.today)),
+                ('due_date', models.DateField()),
+                ('return_date', models.DateField(blank=True, null=True)),
+                ('fine', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('archived_on', models.DateField(default=datetime.date.today)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'borrow_date'], name='library_bor_user_id_ccc429_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('library', '0006_borrowinghistoryarchive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='borrowinghistory',
+            name='library_bor_return__af0a63_idx',
+        ),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['return_date', 'due_date'], name='library_bor_return__49b29e_idx'),
+        ),
+    ]
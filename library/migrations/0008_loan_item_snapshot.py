@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:34
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+ITEM_MODELS = ['EBook', 'PrintedBook', 'ResearchPaper', 'Audiobook']
+BATCH_SIZE = 10000
+
+
+def backfill_item_snapshots(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    for loan_model_name in ('BorrowingHistory', 'BorrowingHistoryArchive'):
+        loan_model = apps.get_model('library', loan_model_name)
+        for model_name in ITEM_MODELS:
+            item_model = apps.get_model('library', model_name)
+            content_type = ContentType.objects.filter(app_label='library', model=model_name.lower()).first()
+            if content_type is None:
+                continue
+            item = item_model.objects.filter(pk=OuterRef('object_id'))
+            loans = loan_model.objects.filter(content_type=content_type)
+            last_id = loans.order_by('-id').values_list('id', flat=True).first() or 0
+            # In id ranges, so no single statement holds the write lock for long
+            for start in range(0, last_id + 1, BATCH_SIZE):
+                loans.filter(id__gte=start, id__lt=start + BATCH_SIZE).update(
+                    item_title=Coalesce(Subquery(item.values('title')[:1]), Value('')),
+                    item_genre=Coalesce(Subquery(item.values('genre')[:1]), Value('')),
+                    item_type=model_name.lower(),
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('library', '0007_open_loan_due_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrowinghistory',
+            name='item_genre',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='borrowinghistory',
+            name='item_title',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='borrowinghistory',
+            name='item_type',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='borrowinghistoryarchive',
+            name='item_genre',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='borrowinghistoryarchive',
+            name='item_title',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='borrowinghistoryarchive',
+            name='item_type',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.RunPython(backfill_item_snapshots, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['item_title'], name='library_bor_item_ti_b2fa74_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['item_genre'], name='library_bor_item_ge_f004d0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['item_type'], name='library_bor_item_ty_b72d9f_idx'),
+        ),
+    ]
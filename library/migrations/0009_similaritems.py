@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_loan_item_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarItems',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_type', models.CharField(max_length=20)),
+                ('item_id', models.PositiveIntegerField()),
+                ('neighbors', models.JSONField(default=list)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('item_type', 'item_id'), name='unique_similar_items')],
+            },
+        ),
+    ]
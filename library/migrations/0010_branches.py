@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_similaritems'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('code', models.SlugField(max_length=20, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='borrowinghistory',
+            name='branch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='library.branch'),
+        ),
+        migrations.AddField(
+            model_name='borrowinghistoryarchive',
+            name='branch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='library.branch'),
+        ),
+        migrations.CreateModel(
+            name='BranchCopies',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('copies_available', models.PositiveIntegerField(default=0)),
+                ('branch', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='library.branch')),
+                ('printed_book', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='library.printedbook')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('printed_book', 'branch'), name='unique_branch_copies')],
+            },
+        ),
+    ]
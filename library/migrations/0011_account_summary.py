@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:45
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def loan_count(loan_model, **filters):
+    loans = (
+        loan_model.objects.filter(user=OuterRef('user'), **filters)
+        .order_by().values('user').annotate(total=Count('id')).values('total')
+    )
+    return Coalesce(Subquery(loans, output_field=IntegerField()), Value(0))
+
+
+def backfill_account_summary(apps, schema_editor):
+    UserLoanState = apps.get_model('library', 'UserLoanState')
+    BorrowingHistory = apps.get_model('library', 'BorrowingHistory')
+    BorrowingHistoryArchive = apps.get_model('library', 'BorrowingHistoryArchive')
+    UserLoanState.objects.update(
+        lifetime_loans=loan_count(BorrowingHistory) + loan_count(BorrowingHistoryArchive),
+        overdue_loans=loan_count(BorrowingHistory, return_date__isnull=True, due_date__lt=datetime.date.today()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_branches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userloanstate',
+            name='lifetime_loans',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userloanstate',
+            name='overdue_loans',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_account_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_account_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userloanstate',
+            name='overdue_as_of',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
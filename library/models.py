@@ -12,6 +12,10 @@ class LibraryItem(models.Model):
 
     class Meta:
         abstract = True
+        indexes = [
+            models.Index(fields=['genre']),
+            models.Index(fields=['publication_date']),
+        ]
 
 class EBook(LibraryItem):
     file_url = models.URLField()
@@ -41,6 +45,32 @@ class Audiobook(LibraryItem):
     def __str__(self):
         return self.title
 
+class Branch(models.Model):
+    code = models.SlugField(max_length=20, primary_key=True)
+    name = models.CharField(max_length=100)
+
+    def __str__(self):
+        return self.name
+
+class BranchCopies(models.Model):
+    # A printed book's copies on the shelf at one branch. Rows live in the
+    # branch's own database when it has one (settings.BRANCH_DATABASES, see
+    # library.routers.BranchRouter), so the foreign keys have no constraints.
+    # PrintedBook.copies_available stays the total: the copies on every
+    # branch's shelf plus any on none. Every borrow of a printed book takes a
+    # shelf copy when one exists, and returns put it back (library.branches).
+    branch = models.ForeignKey(Branch, on_delete=models.DO_NOTHING, db_constraint=False)
+    printed_book = models.ForeignKey(PrintedBook, on_delete=models.DO_NOTHING, db_constraint=False)
+    copies_available = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['printed_book', 'branch'], name='unique_branch_copies'),
+        ]
+
+    def __str__(self):
+        return f"{self.branch_id}: {self.copies_available} of book {self.printed_book_id}"
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     user_type = models.CharField(max_length=20, choices=[
@@ -83,7 +113,7 @@ class GuestProfile(UserProfile):
     def get_borrowing_duration(self):
         return 7  # days
 
-class BorrowingHistory(models.Model):
+class Loan(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
@@ -92,6 +122,25 @@ class BorrowingHistory(models.Model):
     due_date = models.DateField()
     return_date = models.DateField(null=True, blank=True)
     fine = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    # Where a printed book was borrowed, and so where it goes back to
+    branch = models.ForeignKey(Branch, on_delete=models.SET_NULL, null=True, blank=True)
+    # Snapshot of the item taken when it is borrowed, so loans can be grouped
+    # by title, genre or type in SQL without resolving the generic relation.
+    # item_type is the model name, e.g. 'printedbook'.
+    item_title = models.CharField(max_length=255, blank=True, default='')
+    item_genre = models.CharField(max_length=100, blank=True, default='')
+    item_type = models.CharField(max_length=20, blank=True, default='')
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def item_snapshot(item):
+        return {
+            'item_title': item.title,
+            'item_genre': item.genre,
+            'item_type': item._meta.model_name,
+        }
 
     def get_item(self):
         # Force recompute the GenericForeignKey
@@ -99,6 +148,26 @@ class BorrowingHistory(models.Model):
             return self.content_type.get_object_for_this_type(id=self.object_id)
         return None
 
+    def __str__(self):
+        # Uses the cached GenericForeignKey so prefetch_related('item') applies
+        item = self.item
+        return f"{self.user.username} borrowed {item.title if item else 'Unknown Item'}"
+
+class BorrowingHistory(Loan):
+    # Live loans plus recently returned ones; `manage.py archive_loans` moves
+    # older returned loans to BorrowingHistoryArchive.
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['borrow_date']),
+            models.Index(fields=['due_date']),
+            # Also serves open loans (return_date IS NULL) by due date, for the reminder mailer
+            models.Index(fields=['return_date', 'due_date']),
+            models.Index(fields=['item_title']),
+            models.Index(fields=['item_genre']),
+            models.Index(fields=['item_type']),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.due_date:
             user_type = "Unknown"
@@ -125,12 +194,25 @@ class BorrowingHistory(models.Model):
             duration = profile.get_borrowing_duration()
             self.due_date = self.borrow_date + timedelta(days=duration)
 
+        if not self.item_type:
+            item = self.item
+            if item is not None:
+                for field, value in self.item_snapshot(item).items():
+                    setattr(self, field, value)
+
         super().save(*args, **kwargs)
 
-    def __str__(self):
-        item = self.get_item()
-        return f"{self.user.username} borrowed {item.title if item else 'Unknown Item'}"
-    
+class BorrowingHistoryArchive(Loan):
+    # Returned loans past LOAN_ARCHIVE_AFTER_DAYS, keeping their original ids.
+    # Only read when a user asks for their full history.
+    id = models.PositiveIntegerField(primary_key=True)
+    archived_on = models.DateField(default=date.today)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'borrow_date']),
+        ]
+
 class BookReservation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     printed_book = models.ForeignKey(PrintedBook, on_delete=models.CASCADE)
@@ -140,6 +222,51 @@ class BookReservation(models.Model):
 
     class Meta:
         unique_together = ('user', 'printed_book', 'is_active')
+        indexes = [
+            models.Index(fields=['reservation_date']),
+        ]
 
     def __str__(self):
         return f"Reservation for {self.printed_book.title} by {self.user.username}"# Added models 
+
+
+class UserLoanState(models.Model):
+    # Denormalized per-user account summary, kept in step with BorrowingHistory
+    # by LibraryService's borrow and return methods in the same transaction.
+    # `manage.py reconcile_loan_states`, run nightly, repairs any drift and
+    # counts the loans that fell overdue since the last run.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='loan_state')
+    active_loans = models.PositiveIntegerField(default=0)
+    outstanding_fines = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
+    borrowing_limit = models.PositiveIntegerField(default=0)
+    # Every loan ever made, archived ones included
+    lifetime_loans = models.PositiveIntegerField(default=0)
+    # Open loans that were past their due date on overdue_as_of, the day
+    # they were last counted (by the seeding in LibraryService.get_loan_state
+    # or by reconcile_loan_states). Returns only subtract loans counted then.
+    overdue_loans = models.PositiveIntegerField(default=0)
+    overdue_as_of = models.DateField(null=True, blank=True)
+
+    @property
+    def loans_left(self):
+        return max(self.borrowing_limit - self.active_loans, 0)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.active_loans}/{self.borrowing_limit} loans"
+
+
+class SimilarItems(models.Model):
+    # An item's most similar items by TF-IDF over title, author, genre and
+    # type-specific fields, best first, as [item_type, item_id, score] lists.
+    # Rebuilt wholesale by `manage.py build_similar_items`.
+    item_type = models.CharField(max_length=20)
+    item_id = models.PositiveIntegerField()
+    neighbors = models.JSONField(default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item_type', 'item_id'], name='unique_similar_items'),
+        ]
+
+    def __str__(self):
+        return f"{self.item_type} {self.item_id}: {len(self.neighbors)} similar items"
@@ -0,0 +1,100 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+_whitespace_re = re.compile(r'\s+')
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_unsafe_name_re = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def normalize_sql(sql):
+    # Drop literals so the same statement with different ids groups together
+    sql = _literal_re.sub('?', _whitespace_re.sub(' ', sql).strip())
+    return sql[:200].replace(';', ',')
+
+
+_import_roots = sorted((path for path in sys.path if path), key=len, reverse=True)
+
+
+@lru_cache(maxsize=None)
+def frame_name(code):
+    filename = code.co_filename
+    for path in _import_roots:
+        if filename.startswith(path):
+            filename = filename[len(path):].lstrip(os.sep)
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ',')
+
+
+class StackSampler:
+    """Samples the call stack of one thread at a fixed interval.
+
+    Stacks are kept in collapsed form (``root;...;leaf`` -> count). A sample
+    taken while the thread is running a query gets the normalized SQL as an
+    extra leaf frame, so database time shows up under the code that issued it.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.queries = defaultdict(lambda: {'count': 0, 'seconds': 0.0})
+        self.current_sql = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            names.reverse()
+            sql = self.current_sql
+            if sql is not None:
+                names.append(f"SQL: {sql}")
+            self.stacks[';'.join(names)] += 1
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper() for the profiled request
+        self.current_sql = normalize_sql(sql)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats = self.queries[self.current_sql]
+            stats['count'] += 1
+            stats['seconds'] += time.perf_counter() - start
+            self.current_sql = None
+
+    def write(self, output_dir, view_name, wall_seconds):
+        """Write ``<view>/<timestamp>-<pid>.folded`` plus a ``.sql.json`` sidecar."""
+        view_dir = os.path.join(output_dir, _unsafe_name_re.sub('_', view_name) or 'unknown')
+        os.makedirs(view_dir, exist_ok=True)
+        base = os.path.join(view_dir, f"{time.time():.6f}-{os.getpid()}")
+        with open(base + '.folded', 'w', encoding='utf-8') as folded:
+            for stack, count in self.stacks.most_common():
+                folded.write(f"{stack} {count}\n")
+        with open(base + '.sql.json', 'w', encoding='utf-8') as sidecar:
+            json.dump({
+                'view': view_name,
+                'wall_seconds': wall_seconds,
+                'interval': self.interval,
+                'queries': self.queries,
+            }, sidecar)
+        return base + '.folded'
@@ -0,0 +1,70 @@
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def limits_for(view_name):
+    return getattr(settings, 'RATE_LIMITS', {}).get(view_name)
+
+
+def limiter_cache():
+    return caches[getattr(settings, 'RATE_LIMIT_CACHE', 'default')]
+
+
+def take_token(cache, key, rate, burst):
+    """Take one token from the bucket at ``key``; return 0 or the seconds until one is free.
+
+    The bucket holds up to ``burst`` tokens and refills at ``rate`` tokens per
+    second. The read-modify-write isn't atomic across processes, so under a
+    race a bucket can let a request or two more through than configured.
+    """
+    now = time.time()
+    tokens, stamp = cache.get(key) or (burst, now)
+    tokens = min(burst, tokens + (now - stamp) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    # Once full again the entry is the same as no entry, so let it expire
+    cache.set(key, (tokens - 1, now), math.ceil(burst / rate) + 1)
+    return 0
+
+
+class InFlightCounter:
+    """Requests in flight per key in this process, counted under a lock.
+
+    Process-local so that every check-and-increment is atomic and a count
+    dies with its worker instead of leaking into a shared cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def enter(self, key, limit):
+        """Count a request in flight at ``key``; False (and nothing counted) at ``limit``."""
+        with self._lock:
+            if self._counts[key] >= limit:
+                return False
+            self._counts[key] += 1
+            return True
+
+    def leave(self, key):
+        with self._lock:
+            self._counts[key] -= 1
+            if self._counts[key] <= 0:
+                del self._counts[key]
+
+    def count(self, key):
+        with self._lock:
+            return self._counts[key]
+
+
+in_flight = InFlightCounter()
+
+
+def process_limit(limit):
+    """This worker's share of a concurrency cap meant for all ``RATE_LIMIT_WORKERS`` workers."""
+    return max(1, limit // getattr(settings, 'RATE_LIMIT_WORKERS', 1))
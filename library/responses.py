@@ -0,0 +1,72 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+
+from library.cache import two_tier_cache
+from library.services import CATALOG_TAG, CIRCULATION_TAG, catalog_cache_timeout, user_cache_tag
+
+# Where a streamed page's rows go; see render_streaming()
+STREAM_MARKER = '<!-- stream rows -->'
+
+
+def page_etag(request, *args, **kwargs):
+    """ETag for a logged-in user's catalog page, for use with ``@condition``.
+
+    Built from the catalog, circulation and per-user cache tag versions that
+    library.signals and LibraryService bump, so a matching If-None-Match gets
+    a 304 without the view running.
+    """
+    user = request.user
+    # Pending flash messages are shown once, so that page must be rendered
+    if not user.is_authenticated or len(get_messages(request)):
+        return None
+    # Straight from the shared tier: another worker's bump must show at once,
+    # or a user could get a 304 for the page from before their own borrow
+    versions = two_tier_cache.tag_versions(
+        [CATALOG_TAG, CIRCULATION_TAG, user_cache_tag(user.pk)], shared=True,
+    )
+    parts = [
+        request.resolver_match.view_name,
+        user.pk,
+        request.get_full_path(),
+        # A new CSRF secret (e.g. after logging in again) invalidates the forms
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        *versions,
+    ]
+    return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def home_etag(request, *args, **kwargs):
+    # The home page's trending and analytics sections are refreshed on a
+    # timer rather than by tag, so the ETag also changes every cache period
+    etag = page_etag(request)
+    if etag is None:
+        return None
+    return f"{etag}-{int(time.time() // catalog_cache_timeout())}"
+
+
+def render_streaming(request, template_name, context, rows_template, rows_key, chunk_size=100):
+    """Render a page with a long list as a stream, a chunk of rows at a time.
+
+    ``template_name`` renders ``STREAM_MARKER`` in place of the list when
+    ``stream_rows`` is set; ``rows_template`` renders ``context[rows_key]``.
+    The page shell is yielded before any row is rendered, and each chunk is
+    flushed to the client as it is yielded, compressed or not (see
+    ``library.middleware.GZipMiddleware``).
+    """
+    rows = context[rows_key]
+    page = render_to_string(template_name, {**context, rows_key: [], 'stream_rows': True}, request)
+    head, tail = page.split(STREAM_MARKER, 1)
+    rows_template = get_template(rows_template)
+
+    def chunks():
+        yield head
+        for start in range(0, len(rows), chunk_size):
+            yield rows_template.render({**context, rows_key: rows[start:start + chunk_size]}, request)
+        yield tail
+
+    return StreamingHttpResponse(chunks(), content_type='text/html; charset=utf-8')
@@ -0,0 +1,133 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Writes to these apps don't change anything a user reads back (e.g. the
+# session row saved on every request), so they don't pin reads to the primary.
+UNPINNED_APPS = {'sessions', 'admin'}
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+def replica_alias():
+    return getattr(settings, 'REPLICA_DATABASE', 'replica')
+
+
+def replica_available():
+    alias = replica_alias()
+    if alias not in settings.DATABASES:
+        return False
+    # The replica only exists once refresh_replica has run at least once
+    return os.path.exists(connections[alias].settings_dict['NAME'])
+
+
+@contextmanager
+def replica_reads():
+    """Send reads made inside the block to the replica, unless the request is pinned."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def track_request(pinned=False):
+    """Track writes made while handling one request; yields the state dict."""
+    state = {'pinned': pinned, 'wrote': False}
+    token = _request_state.set(state)
+    try:
+        yield state
+    finally:
+        _request_state.reset(token)
+
+
+class ReplicaRouter:
+    """Route analytics reads to the replica and everything else to the primary.
+
+    Only reads made inside ``replica_reads()`` are eligible, and they stay on
+    the primary for a request that has written, or whose user wrote recently
+    (see ``ReplicaPinningMiddleware``), so users always see their own changes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        state = _request_state.get()
+        if state is not None and (state['pinned'] or state['wrote']):
+            return DEFAULT_DB_ALIAS
+        if not replica_available():
+            return DEFAULT_DB_ALIAS
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None and model._meta.app_label not in UNPINNED_APPS:
+            state['wrote'] = True
+        # Instances read from the replica must still be saved to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        dbs = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
+
+
+# Models whose rows are split across the branch databases by branch
+BRANCH_SHARDED_MODELS = {'branchcopies'}
+
+
+def branch_databases():
+    return getattr(settings, 'BRANCH_DATABASES', {})
+
+
+def branch_alias(branch_code):
+    """Database holding ``branch_code``'s inventory; the primary for branches without their own."""
+    return branch_databases().get(branch_code, DEFAULT_DB_ALIAS)
+
+
+def inventory_aliases():
+    return sorted({DEFAULT_DB_ALIAS, *branch_databases().values()})
+
+
+class BranchRouter:
+    """Keep each branch's inventory in that branch's SQLite file.
+
+    Routes saves and related lookups of a ``BranchCopies`` instance by its
+    branch; querysets pick their shard with ``.using(branch_alias(code))``.
+    Branch databases only get the sharded tables, so a borrow at one branch
+    takes that branch's write lock, not another's.
+    """
+
+    def _instance_alias(self, model, hints):
+        instance = hints.get('instance')
+        # Assigning a related object hints with that object instead
+        if model._meta.model_name in BRANCH_SHARDED_MODELS and isinstance(instance, model):
+            return branch_alias(instance.branch_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._instance_alias(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._instance_alias(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._meta.model_name, obj2._meta.model_name} & BRANCH_SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db != DEFAULT_DB_ALIAS and db in branch_databases().values():
+            return app_label == 'library' and model_name in BRANCH_SHARDED_MODELS
+        return None
@@ -0,0 +1,178 @@
+import re
+import threading
+from array import array
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from library.cache import CacheMetrics, SizedLRUCache, two_tier_cache
+from library.services import CATALOG_TAG
+
+# Must match the codes used by the 0004_item_trigram_index migration
+TYPE_CODES = {
+    'ebook': 0,
+    'printedbook': 1,
+    'researchpaper': 2,
+    'audiobook': 3,
+}
+TYPE_NAMES = {code: model_name for model_name, code in TYPE_CODES.items()}
+
+FUZZY_THRESHOLD = 0.3
+# Only the rarest query trigrams are sent to FTS5; common ones like "the"
+# or those spanning a word break match much of the catalog, cost the most
+# to rank and add little. Candidates are re-scored by similarity() anyway.
+MAX_QUERY_TRIGRAMS = 5
+CANDIDATE_LIMIT = 200
+
+_word_re = re.compile(r'\w+')
+
+
+def word_trigrams(text):
+    # Same padding as PostgreSQL's pg_trgm: two spaces before each word, one after
+    trigrams = set()
+    for word in _word_re.findall(text.lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def similarity(query, text):
+    """Trigram similarity between ``query`` and the closest run of words in ``text``.
+
+    Comparing against every window of as many words as the query lets
+    "dostoyevsky" match "Fyodor Dostoevsky" as well as it matches "Dostoevsky".
+    """
+    query_trigrams = word_trigrams(query)
+    if not query_trigrams:
+        return 0.0
+    words = _word_re.findall(text.lower())
+    size = max(1, len(_word_re.findall(query)))
+    best = 0.0
+    for start in range(max(1, len(words) - size + 1)):
+        window = word_trigrams(' '.join(words[start:start + size]))
+        union = len(query_trigrams | window)
+        if union:
+            best = max(best, len(query_trigrams & window) / union)
+    return best
+
+
+def _match_trigrams(cursor, query):
+    text = ' '.join(query.lower().split())
+    trigrams = {text[i:i + 3] for i in range(len(text) - 2)}
+    trigrams = {trigram for trigram in trigrams if ' ' not in trigram} or trigrams
+    if not trigrams:
+        return []
+    placeholders = ', '.join(['%s'] * len(trigrams))
+    cursor.execute(
+        f"SELECT term, doc FROM library_itemtrigram_vocab WHERE term IN ({placeholders})",
+        list(trigrams),
+    )
+    # Trigrams that occur nowhere in the catalog (the typos) can't match anything
+    known = sorted(cursor.fetchall(), key=lambda row: row[1])
+    return [term for term, _ in known[:MAX_QUERY_TRIGRAMS]]
+
+
+def fuzzy_keys(query, models, limit=50):
+    """``(type_code, item_id)`` pairs of the items of ``models`` whose title or author is similar to ``query``, best first."""
+    codes = [TYPE_CODES[model._meta.model_name] for model in models]
+    if not codes:
+        return []
+
+    with connection.cursor() as cursor:
+        trigrams = _match_trigrams(cursor, query)
+        if not trigrams:
+            return []
+        match = ' OR '.join('"{}"'.format(trigram.replace('"', '""')) for trigram in trigrams)
+        type_filter = ', '.join(str(code) for code in codes)
+        cursor.execute(
+            "SELECT rowid, text FROM library_itemtrigram "
+            f"WHERE library_itemtrigram MATCH %s AND (rowid %% 8) / 2 IN ({type_filter}) "
+            "ORDER BY rank LIMIT %s",
+            [match, CANDIDATE_LIMIT],
+        )
+        candidates = cursor.fetchall()
+
+    scores = {}
+    for rowid, text in candidates:
+        score = similarity(query, text)
+        if score < FUZZY_THRESHOLD:
+            continue
+        key = ((rowid % 8) // 2, rowid // 8)
+        scores[key] = max(score, scores.get(key, 0.0))
+
+    ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)[:limit]
+    return [key for key, _ in ranked]
+
+
+def field_keys(query, search_type, models):
+    """``(type_code, item_id)`` pairs of the items whose fields contain ``query``, per model in order."""
+    if search_type == 'genre':
+        condition = Q(genre__icontains=query)
+    elif search_type == 'author':
+        condition = Q(author__icontains=query)
+    else:
+        condition = Q(title__icontains=query) | Q(author__icontains=query) | Q(genre__icontains=query)
+    keys = []
+    for model in models:
+        code = TYPE_CODES[model._meta.model_name]
+        keys.extend((code, item_id) for item_id in model.objects.filter(condition).values_list('id', flat=True))
+    return keys
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+class SearchResultCache:
+    """Per-process cache of search results as compact ``array``s of item keys.
+
+    Keyed by normalized query, search type and the set of item types the
+    user may see (Guests don't see research papers), plus the catalog
+    version that item saves and deletes bump, so results never outlive a
+    catalog change. Bounded by ``SEARCH_CACHE_BYTES`` of result arrays.
+    """
+
+    def __init__(self):
+        self._lru = None
+        self._version = None
+        self._lock = threading.Lock()
+        self.metrics = CacheMetrics()
+
+    @property
+    def lru(self):
+        if self._lru is None:
+            with self._lock:
+                if self._lru is None:
+                    self._lru = SizedLRUCache(getattr(settings, 'SEARCH_CACHE_BYTES', 16 * 1024 * 1024))
+        return self._lru
+
+    def search(self, query, search_type, models):
+        """``(model_name, item_id)`` keys of the results, in display order."""
+        query = normalize_query(query)
+        if not query:
+            return []
+        version = two_tier_cache.tag_versions([CATALOG_TAG])
+        if version != self._version:
+            # Everything cached so far is for an older catalog
+            self.lru.clear()
+            self._version = version
+        visible = tuple(sorted(TYPE_CODES[model._meta.model_name] for model in models))
+        key = (version, search_type, visible, query)
+
+        packed = self.lru.get(key, None)
+        if packed is None:
+            self.metrics.incr('misses')
+            if search_type == 'fuzzy':
+                keys = fuzzy_keys(query, models)
+            else:
+                keys = field_keys(query, search_type, models)
+            # 8 bytes per result: id * 4 + type code
+            packed = array('q', (item_id * 4 + code for code, item_id in keys))
+            self.lru.set(key, packed)
+        else:
+            self.metrics.incr('hits')
+        return [(TYPE_NAMES[value % 4], value // 4) for value in packed]
+
+
+search_cache = SearchResultCache()
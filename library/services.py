@@ -2,11 +2,66 @@ from django.contrib.contenttypes.models import ContentType
 from library.models import (
     BorrowingHistory, EBook, PrintedBook, Audiobook, ResearchPaper,
     StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile,
-    BookReservation
+    BookReservation, UserLoanState, BorrowingHistoryArchive
 )
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.conf import settings
+from django.db import transaction
+from django.dispatch import Signal
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+from django.db.models.functions import Greatest
+from library import branches
+from library.cache import cached, two_tier_cache
+from library.events import availability_hub
+from library.cards import cards_from_queryset, load_cards
+from library.routers import replica_reads
+from library.transactions import atomic_with_retry
+from django.utils import timezone
 from datetime import datetime, timedelta
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODELS = [StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile]
+
+# Sent after borrow_items() bulk-creates loans, which skips post_save.
+# Receivers get ``loans``, the list of new BorrowingHistory rows.
+loans_borrowed = Signal()
+
+def user_type_cache_key(user_id):
+    return f'user_type:{user_id}'
+
+GENRES_CACHE_KEY = 'catalog:genres'
+HOME_SECTIONS_CACHE_KEY = 'home:global_sections:v2'
+# Cache tag bumped by library.signals whenever an item is saved or deleted
+CATALOG_TAG = 'catalog'
+# Bumped whenever a printed book's available copies change
+CIRCULATION_TAG = 'circulation'
+
+def user_cache_tag(user_id):
+    # Bumped when anything shown on a user's own pages changes: their loans,
+    # reservations or profile
+    return f'user:{user_id}'
+
+def bump_tags_on_commit(*tags):
+    transaction.on_commit(lambda: [two_tier_cache.bump_tag(tag) for tag in tags])
+
+def catalog_cache_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+def cached_user_timeout():
+    return getattr(settings, 'CACHED_USER_TIMEOUT', 60)
+
+def fine_borrow_limit():
+    return getattr(settings, 'FINE_BORROW_LIMIT', None)
+
+BORROWING_LIMITS = {
+    'Student': 2,
+    'Faculty': 5,
+    'Researcher': 5,
+    'Guest': 0,
+}
 
 class LibraryService:
     def get_user_borrowing_limit(self, user):
@@ -18,32 +73,104 @@ class LibraryService:
                 break
             except profile_model.DoesNotExist:
                 continue
-        borrowing_limits = {
-            'Student': 2,
-            'Faculty': 5,
-            'Researcher': 5,
-            'Guest': 0,
-        }
-        return borrowing_limits.get(user_type, 0)
+        return BORROWING_LIMITS.get(user_type, 0)
 
+    # Cached per user; library.signals drops the entry when a profile changes.
+    # Never served stale, since the user type decides what a user may see.
+    @cached(lambda self, user: user_type_cache_key(user.pk), timeout=cached_user_timeout, stale_timeout=0)
     def get_user_type(self, user):
+        user_type = "Unknown"
         for profile_model in [StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile]:
             try:
                 profile = profile_model.objects.get(user=user)
-                return profile.user_type
+                user_type = profile.user_type
+                break
             except profile_model.DoesNotExist:
                 continue
-        return "Unknown"
+        return user_type
+
+    def get_loan_state(self, user):
+        try:
+            return UserLoanState.objects.get(user=user)
+        except UserLoanState.DoesNotExist:
+            pass
+        # First time we see this user: seed the counters from their history
+        borrowings = BorrowingHistory.objects.filter(user=user)
+        totals = borrowings.aggregate(
+            loans=Count('id'),
+            active=Count('id', filter=Q(return_date__isnull=True)),
+            overdue=Count('id', filter=Q(return_date__isnull=True, due_date__lt=timezone.now().date())),
+            fines=Sum('fine'),
+        )
+        archived = BorrowingHistoryArchive.objects.filter(user=user).aggregate(loans=Count('id'), fines=Sum('fine'))
+        state, _ = UserLoanState.objects.get_or_create(user=user, defaults={
+            'active_loans': totals['active'],
+            'outstanding_fines': (totals['fines'] or 0) + (archived['fines'] or 0),
+            'borrowing_limit': self.get_user_borrowing_limit(user),
+            'lifetime_loans': totals['loans'] + archived['loans'],
+            'overdue_loans': totals['overdue'],
+            'overdue_as_of': timezone.now().date(),
+        })
+        return state
+
+    def counted_overdue(self, state, borrowing):
+        # Whether ``borrowing`` is among the loans in ``state.overdue_loans``
+        return state.overdue_as_of is not None and borrowing.due_date < state.overdue_as_of
+
+    def fines_block(self, state):
+        """Why fines stop a user with this loan state from borrowing, or None."""
+        limit = fine_borrow_limit()
+        if limit is not None and state.outstanding_fines >= limit:
+            return f"Outstanding fines of Rs.{state.outstanding_fines:.2f} block borrowing until they are paid."
+        return None
 
     def can_user_borrow(self, user):
         if not user.is_authenticated:
             return False
-        active_borrowings = BorrowingHistory.objects.filter(user=user, return_date__isnull=True).count()
-        borrowing_limit = self.get_user_borrowing_limit(user)
-        return active_borrowings < borrowing_limit
+        state = self.get_loan_state(user)
+        return state.active_loans < state.borrowing_limit and self.fines_block(state) is None
+
+    def borrow_item(self, user, item, branch=None):
+        """Borrow ``item``. A printed book comes off ``branch``'s shelf, or
+        without a branch off the first shelf that has a copy.
 
-    def borrow_item(self, user, item):
-        if not self.can_user_borrow(user):
+        ``PrintedBook.copies_available`` counts the copies on every shelf plus
+        those on none, so a book no shelf has a copy of is borrowed from the
+        total alone. The loan itself is written to the default database; the
+        shelf copy is taken in its branch's database beforehand, so the loan's
+        transaction never holds a lock on another database. The checks are
+        made read-only first, so a refused borrow never writes to a branch.
+        """
+        if not isinstance(item, PrintedBook):
+            return self._borrow_item(user, item)
+        [(_, allowed, message)], _ = self._plan_borrows(user, [item])
+        if not allowed:
+            return False, message
+        if branch is not None:
+            if not branches.take_copy(branch, item.id):
+                return False, f"No copies available at {branch.name}."
+        else:
+            branch = branches.take_any_copy(item.id)
+        try:
+            success, message = self._borrow_item(user, item, branch)
+        except BaseException:
+            if branch is not None:
+                branches.put_back(branch.code, item.id)
+            raise
+        # Only when the checks above were overtaken by a concurrent borrow
+        if not success and branch is not None:
+            branches.put_back(branch.code, item.id)
+        return success, message
+
+    @atomic_with_retry
+    def _borrow_item(self, user, item, branch=None):
+        if not user.is_authenticated:
+            return False, "Borrowing limit reached or user not allowed to borrow."
+        state = self.get_loan_state(user)
+        blocked = self.fines_block(state)
+        if blocked:
+            return False, blocked
+        if state.active_loans >= state.borrowing_limit:
             return False, "Borrowing limit reached or user not allowed to borrow."
         
         content_type = ContentType.objects.get_for_model(item)
@@ -56,18 +183,31 @@ class LibraryService:
             return False, "Item already borrowed by this user."
 
         if isinstance(item, PrintedBook):
-            if item.copies_available <= 0:
+            # Decrement in SQL so a retried or concurrent borrow never works
+            # from a stale copies_available value.
+            updated = PrintedBook.objects.filter(id=item.id, copies_available__gt=0).update(
+                copies_available=F('copies_available') - 1
+            )
+            if not updated:
                 return False, "No copies available."
-            item.copies_available -= 1
-            item.save()
+            item.refresh_from_db(fields=['copies_available'])
+            bump_tags_on_commit(CIRCULATION_TAG)
+            transaction.on_commit(lambda: availability_hub.publish(item.id, item.copies_available))
 
         BorrowingHistory.objects.create(
             user=user,
             content_type=content_type,
             object_id=item.id,
+            branch=branch,
+            **BorrowingHistory.item_snapshot(item),
+        )
+        UserLoanState.objects.filter(user=user).update(
+            active_loans=F('active_loans') + 1,
+            lifetime_loans=F('lifetime_loans') + 1,
         )
         return True, "Item borrowed successfully."
 
+    @atomic_with_retry
     def return_item(self, user, item, return_date=None):
         content_type = ContentType.objects.get_for_model(item)
         try:
@@ -79,26 +219,262 @@ class LibraryService:
             )
         except BorrowingHistory.DoesNotExist:
             return False, "Borrowing record not found."
+        # Make sure the counters exist (seeded from history) before this return changes it
+        state = self.get_loan_state(user)
 
         if return_date is None:
             return_date = datetime.now().date()
         borrowing.return_date = return_date
         borrowing.fine = self.calculate_fine(borrowing, return_date)
         borrowing.save()
+        was_overdue = int(self.counted_overdue(state, borrowing))
+        UserLoanState.objects.filter(user=user).update(
+            active_loans=Greatest(F('active_loans') - 1, 0),
+            overdue_loans=Greatest(F('overdue_loans') - was_overdue, 0),
+            outstanding_fines=F('outstanding_fines') + borrowing.fine,
+        )
 
         if isinstance(item, PrintedBook):
-            item.copies_available += 1
-            item.save()
-            # Check for reservations and notify users if any
-            self.notify_reservation_users(item)
+            PrintedBook.objects.filter(id=item.id).update(copies_available=F('copies_available') + 1)
+            item.refresh_from_db(fields=['copies_available'])
+            bump_tags_on_commit(CIRCULATION_TAG)
+            # Push the new count to open availability streams, see library.events
+            transaction.on_commit(lambda: availability_hub.publish(item.id, item.copies_available))
+            if borrowing.branch_id:
+                # Back on the shelf it came from, in that branch's database
+                transaction.on_commit(lambda: branches.put_back(borrowing.branch_id, item.id), robust=True)
+            # Check for reservations and notify users if any, once the write
+            # lock has been released rather than while holding it over SMTP
+            transaction.on_commit(lambda: self.notify_reservation_users(item))
 
         return True, "Item returned successfully."
 
-    def calculate_fine(self, borrowing, return_date):
-        item = borrowing.get_item()
-        print(f"Item Type: {item.__class__.__name__ if item else 'Unknown'}")
+    def get_borrowing_history(self, user, include_archived=False):
+        # The live table alone unless the full history is asked for. Rows
+        # carry a snapshot of their item, and their content type for the
+        # return link, so the page never loads the items themselves
+        loans = BorrowingHistory.objects.filter(user=user).select_related('content_type').order_by('borrow_date', 'id')
+        if not include_archived:
+            return list(loans)
+        archived = (
+            BorrowingHistoryArchive.objects.filter(user=user)
+            .select_related('content_type').order_by('borrow_date', 'id')
+        )
+        return list(heapq.merge(archived, loans, key=lambda loan: (loan.borrow_date, loan.id)))
+
+    def get_user_profile(self, user):
+        for profile_model in PROFILE_MODELS:
+            profile = profile_model.objects.filter(user=user).first()
+            if profile:
+                return profile
+        return None
+
+    def _items_filter(self, items):
+        # One Q per item type, so a batch needs a single query whatever its size
+        ids_by_type = {}
+        for item in items:
+            content_type = ContentType.objects.get_for_model(item)
+            ids_by_type.setdefault(content_type, []).append(item.id)
+        query = Q(pk__in=[])
+        for content_type, ids in ids_by_type.items():
+            query |= Q(content_type=content_type, object_id__in=ids)
+        return query
+
+    def borrow_items(self, user, items):
+        """Borrow several items in one transaction.
+
+        Returns a ``(item, success, message)`` tuple per item, in order. The
+        number of queries doesn't depend on the number of items: the checks
+        are made read-only first, then the printed books that pass come off
+        their shelves with one statement per branch, as in ``borrow_item()``.
+        """
+        planned, _ = self._plan_borrows(user, items)
+        taken = branches.take_any_copies(
+            list({item.id for item, allowed, _ in planned if allowed and isinstance(item, PrintedBook)})
+        )
+        try:
+            results = self._borrow_items(user, items, taken)
+        except BaseException:
+            branches.put_back_all((branch.code, book_id) for book_id, branch in taken.items())
+            raise
+        # Back on the shelf if the loan wasn't made after all
+        borrowed = {item.id for item, success, _ in results if success and isinstance(item, PrintedBook)}
+        branches.put_back_all((branch.code, book_id) for book_id, branch in taken.items() if book_id not in borrowed)
+        return results
+
+    def _plan_borrows(self, user, items):
+        """``(item, success, message)`` per item for borrowing ``items`` now, and the due date.
+
+        Only reads, in a constant number of queries; ``_borrow_items()`` runs
+        it again inside its transaction before writing.
+        """
+        refused = "Borrowing limit reached or user not allowed to borrow."
+        if not user.is_authenticated:
+            return [(item, False, refused) for item in items], None
+
+        state = self.get_loan_state(user)
+        blocked = self.fines_block(state)
+        if blocked:
+            return [(item, False, blocked) for item in items], None
+        slots = state.borrowing_limit - state.active_loans
+        already_borrowed = set(
+            BorrowingHistory.objects.filter(user=user, return_date__isnull=True)
+            .filter(self._items_filter(items))
+            .values_list('content_type_id', 'object_id')
+        )
+        copies = dict(
+            PrintedBook.objects.filter(id__in=[item.id for item in items if isinstance(item, PrintedBook)])
+            .values_list('id', 'copies_available')
+        )
+        profile = self.get_user_profile(user)
+        due_date = None
+        if profile:
+            due_date = datetime.now().date() + timedelta(days=profile.get_borrowing_duration())
+
+        results = []
+        for item in items:
+            key = (ContentType.objects.get_for_model(item).id, item.id)
+            if key in already_borrowed:
+                results.append((item, False, "Item already borrowed by this user."))
+                continue
+            if slots <= 0 or due_date is None:
+                results.append((item, False, refused))
+                continue
+            if isinstance(item, PrintedBook):
+                if copies.get(item.id, 0) <= 0:
+                    results.append((item, False, "No copies available."))
+                    continue
+                copies[item.id] -= 1
+            already_borrowed.add(key)
+            slots -= 1
+            results.append((item, True, "Item borrowed successfully."))
+        return results, due_date
+
+    @atomic_with_retry
+    def _borrow_items(self, user, items, shelves):
+        results, due_date = self._plan_borrows(user, items)
+        loans, printed_ids = [], []
+        for item, success, _ in results:
+            if not success:
+                continue
+            if isinstance(item, PrintedBook):
+                printed_ids.append(item.id)
+            loans.append(BorrowingHistory(
+                user=user, content_type_id=ContentType.objects.get_for_model(item).id, object_id=item.id,
+                due_date=due_date, branch=shelves.get(item.id) if isinstance(item, PrintedBook) else None,
+                **BorrowingHistory.item_snapshot(item),
+            ))
+
+        if loans:
+            BorrowingHistory.objects.bulk_create(loans)
+            if printed_ids:
+                PrintedBook.objects.filter(id__in=printed_ids).update(copies_available=F('copies_available') - 1)
+                bump_tags_on_commit(CIRCULATION_TAG)
+                transaction.on_commit(lambda: availability_hub.publish_books(printed_ids))
+            UserLoanState.objects.filter(user=user).update(
+                active_loans=F('active_loans') + len(loans),
+                lifetime_loans=F('lifetime_loans') + len(loans),
+            )
+            transaction.on_commit(lambda: loans_borrowed.send(sender=self.__class__, loans=loans))
+        return results
+
+    @atomic_with_retry
+    def return_items(self, user, items, return_date=None):
+        """Return several items in one transaction; see ``borrow_items``."""
+        if return_date is None:
+            return_date = datetime.now().date()
+        state = self.get_loan_state(user)
+        open_loans = {
+            (borrowing.content_type_id, borrowing.object_id): borrowing
+            for borrowing in BorrowingHistory.objects.filter(user=user, return_date__isnull=True)
+            .filter(self._items_filter(items))
+        }
+
+        results, returned, printed_books = [], [], []
+        for item in items:
+            borrowing = open_loans.pop((ContentType.objects.get_for_model(item).id, item.id), None)
+            if borrowing is None:
+                results.append((item, False, "Borrowing record not found."))
+                continue
+            borrowing.return_date = return_date
+            borrowing.fine = self.calculate_fine(borrowing, return_date, item=item)
+            returned.append(borrowing)
+            if isinstance(item, PrintedBook):
+                printed_books.append(item)
+            results.append((item, True, "Item returned successfully."))
+
+        if returned:
+            BorrowingHistory.objects.bulk_update(returned, ['return_date', 'fine'])
+            # bulk_update() skips the post_save handler that normally does this
+            bump_tags_on_commit(user_cache_tag(user.pk))
+            if printed_books:
+                PrintedBook.objects.filter(id__in=[book.id for book in printed_books]).update(
+                    copies_available=F('copies_available') + 1
+                )
+                bump_tags_on_commit(CIRCULATION_TAG)
+                transaction.on_commit(lambda: availability_hub.publish_books([book.id for book in printed_books]))
+                shelved = [(borrowing.branch_id, borrowing.object_id) for borrowing in returned
+                           if borrowing.branch_id and borrowing.item_type == 'printedbook']
+                if shelved:
+                    transaction.on_commit(lambda: branches.put_back_all(shelved), robust=True)
+            was_overdue = sum(self.counted_overdue(state, borrowing) for borrowing in returned)
+            UserLoanState.objects.filter(user=user).update(
+                active_loans=Greatest(F('active_loans') - len(returned), 0),
+                overdue_loans=Greatest(F('overdue_loans') - was_overdue, 0),
+                outstanding_fines=F('outstanding_fines') + sum(borrowing.fine for borrowing in returned),
+            )
+            transaction.on_commit(lambda: self.notify_reservations(printed_books))
+        return results
+
+    @cached(HOME_SECTIONS_CACHE_KEY, timeout=catalog_cache_timeout, tags=[CATALOG_TAG])
+    def get_home_sections(self):
+        """Trending, research papers and borrowing analytics for the home page.
+
+        These are global aggregates, so they are computed from the replica and
+        cached for everyone for ``CATALOG_CACHE_TIMEOUT`` seconds. Borrows and
+        returns don't invalidate them, so the cards' ``copies_available`` can
+        be stale; see ``library.cards.with_current_copies()``.
+        """
+        book_models = {model._meta.model_name: model for model in [EBook, PrintedBook, Audiobook]}  # Exclude ResearchPaper
+        with replica_reads():
+            # Grouped on the loans' item snapshot columns, in SQL
+            loans = BorrowingHistory.objects.exclude(item_title='')
+            thirty_days_ago = timezone.now().date() - timedelta(days=30)
+            trending = self._most_borrowed_items(loans.filter(borrow_date__gte=thirty_days_ago), book_models)
+            if not trending:
+                trending = self._most_borrowed_items(loans, book_models)
+
+            research_papers = cards_from_queryset(ResearchPaper.objects.all()[:5])
+
+            most_borrowed = list(
+                loans.values(title=F('item_title')).annotate(total=Count('id')).order_by('-total')[:5]
+            )
+            popular_genres = list(
+                loans.values(genre=F('item_genre')).annotate(total=Count('id')).order_by('-total')[:5]
+            )
+
+        return {
+            'trending': trending,
+            'research_papers': research_papers,
+            'most_borrowed': most_borrowed,
+            'popular_genres': popular_genres,
+        }
+
+    def _most_borrowed_items(self, loans, models, limit=5):
+        top = (
+            loans.filter(item_type__in=list(models))
+            .values('item_type', 'object_id')
+            .annotate(total=Count('id'))
+            .order_by('-total')[:limit]
+        )
+        return load_cards([(row['item_type'], row['object_id']) for row in top], models.values())
+
+    def calculate_fine(self, borrowing, return_date, item=None):
+        if item is None:
+            item = borrowing.get_item()
         if not item or not isinstance(item, (PrintedBook, ResearchPaper)):
-            print("No fine: Item is not a PrintedBook or ResearchPaper.")
+            logger.debug("No fine for loan %s: %s is not a PrintedBook or ResearchPaper",
+                         borrowing.pk, item.__class__.__name__ if item else 'missing item')
             return 0.00
         due_date = borrowing.due_date
         if return_date > due_date:
@@ -123,6 +499,37 @@ class LibraryService:
         BookReservation.objects.create(user=user, printed_book=printed_book)
         return True, "Book reserved successfully. You will be notified when a copy is available."
 
+    def reservation_email(self, reservation):
+        user, printed_book = reservation.user, reservation.printed_book
+        return EmailMessage(
+            subject=f"Book Available: {printed_book.title}",
+            body=f"Dear {user.username},\n\nThe book '{printed_book.title}' is now available for borrowing at Nexus Library. Please visit the library to borrow it within 3 days, or your reservation will be canceled.\n\nBest regards,\nNexus Library Team",
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[user.email],
+        )
+
+    def due_reminder_email(self, user, loans, today):
+        # One digest per user; ``loans`` are (borrowing, title) pairs
+        overdue = [(b, title) for b, title in loans if b.due_date < today]
+        due_soon = [(b, title) for b, title in loans if b.due_date >= today]
+        lines = [f"Dear {user.username},", ""]
+        if overdue:
+            lines.append("These items are overdue. Please return them as soon as possible to limit your fines:")
+            lines.extend(f"  - {title} (due {b.due_date}, {(today - b.due_date).days} days overdue)" for b, title in overdue)
+            lines.append("")
+        if due_soon:
+            lines.append("These items are due soon:")
+            lines.extend(f"  - {title} (due {b.due_date})" for b, title in due_soon)
+            lines.append("")
+        lines.extend(["Best regards,", "Nexus Library Team"])
+        subject = "Overdue items at Nexus Library" if overdue else "Items due soon at Nexus Library"
+        return EmailMessage(
+            subject=subject,
+            body="\n".join(lines),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[user.email],
+        )
+
     def notify_reservation_users(self, printed_book):
         reservations = BookReservation.objects.filter(
             printed_book=printed_book,
@@ -134,59 +541,73 @@ class LibraryService:
             reservation = reservations.first()
             user = reservation.user
             try:
-                send_mail(
-                    subject=f"Book Available: {printed_book.title}",
-                    message=f"Dear {user.username},\n\nThe book '{printed_book.title}' is now available for borrowing at Nexus Library. Please visit the library to borrow it within 3 days, or your reservation will be canceled.\n\nBest regards,\nNexus Library Team",
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[user.email],
-                    fail_silently=False,
-                )
+                self.reservation_email(reservation).send(fail_silently=False)
                 reservation.notified = True
                 reservation.save()
                
             except Exception as e:
                 print(f"Failed to send email to {user.email}: {e}")
 
+    def notify_reservations(self, printed_books):
+        # Batch form of notify_reservation_users: one query for the oldest
+        # waiting reservation of each book, one SMTP connection for all emails.
+        book_ids = [book.id for book in printed_books]
+        if not book_ids:
+            return
+        first_reservations = {}
+        reservations = BookReservation.objects.filter(
+            printed_book_id__in=book_ids,
+            printed_book__copies_available__gt=0,
+            is_active=True,
+            notified=False,
+        ).select_related('user', 'printed_book').order_by('reservation_date')
+        for reservation in reservations:
+            first_reservations.setdefault(reservation.printed_book_id, reservation)
+        if not first_reservations:
+            return
+
+        try:
+            connection = get_connection(fail_silently=False)
+            connection.send_messages([self.reservation_email(r) for r in first_reservations.values()])
+        except Exception:
+            logger.exception("Failed to send reservation emails")
+            return
+        BookReservation.objects.filter(id__in=[r.id for r in first_reservations.values()]).update(notified=True)
+
 class BookExplorerService(LibraryService):
     def __init__(self):
         super().__init__()
         self.book_models = [EBook, PrintedBook, Audiobook]  
 
+    @cached(GENRES_CACHE_KEY, timeout=catalog_cache_timeout, tags=[CATALOG_TAG])
     def get_all_genres(self):
         genres = set()
         for model in self.book_models:
-            model_genres = model.objects.values_list('genre', flat=True).distinct()
-            print(f"Genres for {model.__name__}: {list(model_genres)}")
-            genres.update(model_genres)
+            genres.update(model.objects.values_list('genre', flat=True).distinct())
         genres.add("Research Papers")
-        print(f"All genres: {genres}")
+        logger.debug("All genres: %s", genres)
         return sorted(list(genres))
 
     def get_books_by_genre(self, genre, user=None):
         if genre == "Research Papers":
-            papers = ResearchPaper.objects.all()
-            print(f"Research Papers: {list(papers.values('id', 'title', 'genre'))}")
-            return list(papers)
+            return cards_from_queryset(ResearchPaper.objects.all())
 
         books = []
-        borrowed_ids = set()
-
-        if user:
-            user_borrowings = BorrowingHistory.objects.filter(user=user)
-            for borrowing in user_borrowings:
-                if borrowing.content_type.model in [m.__name__.lower() for m in self.book_models]:
-                    borrowed_ids.add(borrowing.object_id)
-            print(f"Borrowed IDs for user {user.username}: {borrowed_ids}")
-
         # Fetch books from each model that match the genre
         for model in self.book_models:
             # Use case-insensitive matching for genre
             query = model.objects.filter(genre__iexact=genre)
-            print(f"Books in {model.__name__} for genre '{genre}' (before exclusion): {list(query.values('id', 'title', 'genre'))}")
-            if borrowed_ids:
-                query = query.exclude(id__in=borrowed_ids)
-            books.extend(query)
-            print(f"Books in {model.__name__} for genre '{genre}' (after exclusion): {list(query.values('id', 'title', 'genre'))}")
+            if user:
+                # Hide what the user currently has out, matched on this item
+                # type only, inside the same statement
+                active_loans = BorrowingHistory.objects.filter(
+                    user=user,
+                    content_type=ContentType.objects.get_for_model(model),
+                    object_id=OuterRef('pk'),
+                    return_date__isnull=True,
+                )
+                query = query.filter(~Exists(active_loans))
+            books.extend(cards_from_queryset(query))
 
-        print(f"Total books found for genre '{genre}': {len(books)}")
+        logger.debug("Total books found for genre '%s': %d", genre, len(books))
         return books
\ No newline at end of file
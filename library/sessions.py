@@ -0,0 +1,44 @@
+import copy
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+from library.cache import LocalLRUCache
+
+# Sessions of the users this worker served recently. Entries expire after
+# LOCAL_CACHE_TIMEOUT, which bounds how long a logout made on another worker
+# can go unnoticed here.
+local_sessions = LocalLRUCache()
+
+
+class SessionStore(CachedDBStore):
+    """cached_db sessions with an extra in-process tier.
+
+    Lookups go local LRU -> shared cache -> database, and every save still
+    writes through to the database.
+    """
+
+    def load(self):
+        if not self.session_key:
+            return super().load()
+        data = local_sessions.get(self.cache_key, None)
+        if data is None:
+            data = super().load()
+            if data:
+                local_sessions.set(self.cache_key, copy.deepcopy(data), self._local_timeout())
+            return data
+        # Each request gets its own copy to modify
+        return copy.deepcopy(data)
+
+    def save(self, must_create=False):
+        super().save(must_create)
+        local_sessions.set(self.cache_key, copy.deepcopy(self._session), self._local_timeout())
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key:
+            local_sessions.delete(self.cache_key_prefix + session_key)
+        super().delete(session_key)
+
+    def _local_timeout(self):
+        return min(getattr(settings, 'LOCAL_CACHE_TIMEOUT', 10), self.get_expiry_age())
@@ -0,0 +1,77 @@
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from library.models import (
+    BorrowingHistory, BookReservation, UserLoanState,
+    StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile,
+)
+from library.auth import user_cache_key
+from library.cache import two_tier_cache
+from library.services import (
+    BORROWING_LIMITS, CATALOG_TAG, bump_tags_on_commit, loans_borrowed, user_cache_tag, user_type_cache_key,
+)
+from library.typeahead import ITEM_MODELS, typeahead_index
+
+
+def item_saved(sender, instance, **kwargs):
+    typeahead_index.update_item(instance)
+    two_tier_cache.bump_tag(CATALOG_TAG)
+
+
+def item_deleted(sender, instance, **kwargs):
+    typeahead_index.remove_item(instance)
+    two_tier_cache.bump_tag(CATALOG_TAG)
+
+
+for model in ITEM_MODELS:
+    post_save.connect(item_saved, sender=model, dispatch_uid=f'typeahead_save_{model._meta.model_name}')
+    post_delete.connect(item_deleted, sender=model, dispatch_uid=f'typeahead_delete_{model._meta.model_name}')
+
+
+@receiver(post_save, sender=BorrowingHistory)
+def borrowing_saved(sender, instance, created, **kwargs):
+    if created:
+        model_name = ContentType.objects.get_for_id(instance.content_type_id).model
+        typeahead_index.record_borrow(model_name, instance.object_id)
+    bump_tags_on_commit(user_cache_tag(instance.user_id))
+
+
+@receiver(loans_borrowed)
+def loans_bulk_borrowed(sender, loans, **kwargs):
+    for loan in loans:
+        model_name = ContentType.objects.get_for_id(loan.content_type_id).model
+        typeahead_index.record_borrow(model_name, loan.object_id)
+    # Sent after commit already
+    for user_id in {loan.user_id for loan in loans}:
+        two_tier_cache.bump_tag(user_cache_tag(user_id))
+
+
+@receiver([post_save, post_delete], sender=BookReservation)
+def reservation_changed(sender, instance, **kwargs):
+    bump_tags_on_commit(user_cache_tag(instance.user_id))
+
+
+def profile_saved(sender, instance, **kwargs):
+    # The borrowing limit is denormalized onto the loan state
+    UserLoanState.objects.filter(user_id=instance.user_id).update(
+        borrowing_limit=BORROWING_LIMITS.get(instance.user_type, 0)
+    )
+    two_tier_cache.delete(user_type_cache_key(instance.user_id))
+    bump_tags_on_commit(user_cache_tag(instance.user_id))
+
+
+def profile_deleted(sender, instance, **kwargs):
+    two_tier_cache.delete(user_type_cache_key(instance.user_id))
+    bump_tags_on_commit(user_cache_tag(instance.user_id))
+
+
+for model in [StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile]:
+    post_save.connect(profile_saved, sender=model, dispatch_uid=f'loan_state_{model._meta.model_name}')
+    post_delete.connect(profile_deleted, sender=model, dispatch_uid=f'user_type_{model._meta.model_name}')
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    two_tier_cache.delete(user_cache_key(instance.pk))
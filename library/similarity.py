@@ -0,0 +1,189 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from library.models import EBook, PrintedBook, ResearchPaper, Audiobook, SimilarItems
+
+ITEM_MODELS = [EBook, PrintedBook, Audiobook, ResearchPaper]
+# Type-specific fields added to an item's document, as one term each
+EXTRA_FIELDS = {
+    'audiobook': ('narrator',),
+    'researchpaper': ('access_level',),
+}
+
+_word_re = re.compile(r'\w+')
+
+
+def item_terms(title, author, genre, extra=()):
+    """Terms of an item's document: title words, plus one term per author, genre and extra field.
+
+    There is no term for the item's type: shared by a whole model, it would
+    pair nearly every item with every other while saying little about them.
+    """
+    terms = _word_re.findall(title.lower())
+    terms.append('author:' + ' '.join(author.lower().split()))
+    terms.append('genre:' + genre.lower())
+    for field, value in extra:
+        if value:
+            terms.append(f"{field}:{' '.join(value.lower().split())}")
+    return terms
+
+
+def catalog_documents():
+    """``(model_name, item_id)`` keys and the matching term lists for every item."""
+    keys, documents = [], []
+    for model in ITEM_MODELS:
+        model_name = model._meta.model_name
+        extra_fields = EXTRA_FIELDS.get(model_name, ())
+        rows = model.objects.order_by('id').values_list('id', 'title', 'author', 'genre', *extra_fields)
+        for item_id, title, author, genre, *extra in rows.iterator(chunk_size=2000):
+            keys.append((model_name, item_id))
+            documents.append(item_terms(title, author, genre, zip(extra_fields, extra)))
+    return keys, documents
+
+
+def tfidf_vectors(documents):
+    """L2-normalized sparse TF-IDF vectors, as ``{term: weight}`` dicts.
+
+    Terms found in a single document are dropped after normalizing: they
+    count towards an item's norm but can't make it similar to anything.
+    """
+    counts = [Counter(terms) for terms in documents]
+    df = Counter(term for tf in counts for term in tf)
+    n = len(documents)
+    idf = {term: math.log((1 + n) / (1 + freq)) + 1 for term, freq in df.items()}
+    vectors = []
+    for tf in counts:
+        weights = {term: (1 + math.log(count)) * idf[term] for term, count in tf.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        vectors.append({term: w / norm for term, w in weights.items() if df[term] > 1})
+    return vectors
+
+
+def top_neighbors(vectors, k, memory=64 * 1024 * 1024):
+    """The ``k`` most cosine-similar other vectors of each vector, as ``[(index, score)]`` lists, best first.
+
+    Both paths walk an inverted index, so an item is only scored against the
+    items it shares a term with: vectorized in blocks of rows bounded by
+    ``memory`` when NumPy is installed, and in pure Python otherwise.
+    """
+    if np is not None:
+        return _top_neighbors_numpy(vectors, k, memory)
+    return _top_neighbors_python(vectors, k)
+
+
+def _top_neighbors_python(vectors, k):
+    postings = defaultdict(list)
+    for index, vector in enumerate(vectors):
+        for term, weight in vector.items():
+            postings[term].append((index, weight))
+    neighbors = []
+    for index, vector in enumerate(vectors):
+        scores = defaultdict(float)
+        for term, weight in vector.items():
+            for other, other_weight in postings[term]:
+                scores[other] += weight * other_weight
+        scores.pop(index, None)
+        neighbors.append(heapq.nlargest(k, scores.items(), key=lambda pair: pair[1]))
+    return neighbors
+
+
+def _top_neighbors_numpy(vectors, k, memory):
+    vocabulary = {}
+    indptr, indices, data = [0], [], []
+    for vector in vectors:
+        for term, weight in vector.items():
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            data.append(weight)
+        indptr.append(len(indices))
+    indptr = np.array(indptr, dtype=np.int64)
+    indices = np.array(indices, dtype=np.int64)
+    data = np.array(data, dtype=np.float64)
+    n = len(vectors)
+    if k < 1:
+        return [[] for _ in vectors]
+
+    # The same matrix by term, built once: each term's posting list of (item, weight)
+    order = np.argsort(indices, kind='stable')
+    df = np.bincount(indices, minlength=len(vocabulary))
+    postings_ptr = np.concatenate([[0], np.cumsum(df)])
+    postings_items = np.repeat(np.arange(n), np.diff(indptr))[order]
+    postings_data = data[order]
+
+    # An item is paired with every item on each of its terms' posting lists;
+    # blocks of rows are cut so their pairs (~40 bytes each) and their dense
+    # (rows x n) score block (~16 bytes a cell) each fit in half of ``memory``
+    pairs_before = np.concatenate([[0], np.cumsum(df[indices])])[indptr]
+    max_pairs = max(1, memory // 2 // 40)
+    max_rows = max(1, memory // 2 // (16 * max(n, 1)))
+
+    neighbors = []
+    row_start = 0
+    while row_start < n:
+        fits = np.searchsorted(pairs_before, pairs_before[row_start] + max_pairs, side='right') - 1
+        row_stop = int(min(max(fits, row_start + 1), row_start + max_rows, n))
+        rows = row_stop - row_start
+        lo, hi = indptr[row_start], indptr[row_stop]
+        terms = indices[lo:hi]
+        lengths = df[terms]
+        # Expand every (row, term) entry into the term's postings
+        firsts = np.repeat(postings_ptr[terms] - (np.cumsum(lengths) - lengths), lengths)
+        positions = firsts + np.arange(lengths.sum())
+        entry_rows = np.repeat(np.arange(rows), np.diff(indptr[row_start:row_stop + 1]))
+        scores = np.bincount(
+            np.repeat(entry_rows * n, lengths) + postings_items[positions],
+            weights=np.repeat(data[lo:hi], lengths) * postings_data[positions],
+            minlength=rows * n,
+        ).reshape(rows, n)
+        # An item is not its own neighbor
+        scores[np.arange(rows), np.arange(row_start, row_stop)] = -np.inf
+        if k < n:
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            best = np.broadcast_to(np.arange(n), (rows, n))
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        for row_scores, others in zip(best_scores.tolist(), best.tolist()):
+            neighbors.append([(other, score) for other, score in zip(others, row_scores) if score > 0])
+        row_start = row_stop
+    return neighbors
+
+
+def build_similar_items(k=10, memory=64 * 1024 * 1024):
+    """Compute every item's ``k`` nearest neighbors; return ``SimilarItems`` instances, unsaved."""
+    keys, documents = catalog_documents()
+    neighbors = top_neighbors(tfidf_vectors(documents), k, memory)
+    return [
+        SimilarItems(
+            item_type=model_name,
+            item_id=item_id,
+            neighbors=[[*keys[other], round(score, 4)] for other, score in item_neighbors],
+        )
+        for (model_name, item_id), item_neighbors in zip(keys, neighbors)
+    ]
+
+
+def load_similar_items(model_name, item_id, models, limit=10):
+    """Up to ``limit`` stored neighbors of an item among ``models``, best first, with their scores."""
+    row = SimilarItems.objects.filter(item_type=model_name, item_id=item_id).values_list('neighbors', flat=True).first()
+    if not row:
+        return []
+    models_by_name = {model._meta.model_name: model for model in models}
+    neighbors = [(name, other_id, score) for name, other_id, score in row if name in models_by_name][:limit]
+    ids_by_name = {}
+    for name, other_id, _ in neighbors:
+        ids_by_name.setdefault(name, []).append(other_id)
+    items = {
+        (name, item.id): item
+        for name, ids in ids_by_name.items()
+        for item in models_by_name[name].objects.filter(id__in=ids)
+    }
+    return [(items[name, other_id], score) for name, other_id, score in neighbors if (name, other_id) in items]
@@ -0,0 +1,62 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only .gz siblings are written without it
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.map'}
+# Below this size the Content-Encoding header costs about as much as it saves
+MIN_COMPRESS_SIZE = 256
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest storage that also writes .gz and .br siblings at collectstatic time.
+
+    Served by ``library.middleware.PrecompressedStaticMiddleware``, which picks
+    the sibling matching the request's Accept-Encoding. Until collectstatic
+    has run (a fresh checkout, the test suite) there is no manifest, and
+    ``{% static %}`` falls back to the plain names.
+    """
+
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Not in the manifest and not collected into STATIC_ROOT either
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if dry_run or isinstance(processed, Exception):
+                continue
+            for path in {name, hashed_name}:
+                if path and os.path.splitext(path)[1] in COMPRESSIBLE_EXTENSIONS:
+                    self.compress(path)
+
+    def compress(self, path):
+        with self.open(path) as original:
+            content = original.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        for suffix, compressed in self.compressed_variants(content):
+            # Only keep variants that actually save bytes
+            if len(compressed) >= len(content):
+                continue
+            target = path + suffix
+            if self.exists(target):
+                self.delete(target)
+            self._save(target, ContentFile(compressed))
+
+    def compressed_variants(self, content):
+        # mtime=0 keeps the .gz output identical between collectstatic runs
+        yield '.gz', gzip.compress(content, compresslevel=9, mtime=0)
+        if brotli is not None:
+            yield '.br', brotli.compress(content)
@@ -1,3 +1,1011 @@
-from django.test import TestCase
+import contextlib
+import glob
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from unittest import mock, skipUnless
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.core.paginator import EmptyPage
+from django.db import OperationalError, connection
+from django.db.models import QuerySet
+from django.templatetags.static import static
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from library import branches, ratelimit
+from library.admin import EstimatedCountPaginator
+from library.auth import CachedModelBackend
+from library.cache import ExpiringFileBasedCache, two_tier_cache
+from library.cards import load_cards, with_status
+from library.events import availability_hub
+from library.management.commands import reconcile_loan_states
+from library.middleware import PIN_COOKIE
+from library.models import (
+    BorrowingHistory, BorrowingHistoryArchive, BranchCopies, EBook, FacultyProfile, GuestProfile, PrintedBook, ResearchPaper, StudentProfile, UserLoanState,
+)
+from library.profiling import normalize_sql
+from library.routers import ReplicaRouter, replica_reads, track_request
+from library.search import FUZZY_THRESHOLD, TYPE_CODES, fuzzy_keys, search_cache, similarity
+from library.services import CIRCULATION_TAG, BookExplorerService, LibraryService
+from library.sessions import SessionStore, local_sessions
+from library.similarity import _top_neighbors_numpy, _top_neighbors_python, np, tfidf_vectors
+from library.transactions import atomic_with_retry
+from library.typeahead import typeahead_index
+from library.views import MAX_BATCH_ITEMS
+from library.warmup import warm_worker
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit',
+    },
+}
+
+
+def make_user(username, profile_model=StudentProfile, user_type='Student'):
+    user = User.objects.create_user(username, f'{username}@example.com')
+    profile_model.objects.create(user=user, user_type=user_type)
+    return user
+
+
+def make_book(title='Dune', copies=1, genre='Fiction', author='Frank Herbert', **kwargs):
+    return PrintedBook.objects.create(
+        title=title, author=author, genre=genre, publication_date=date(2000, 1, 1),
+        isbn='9780000000000', copies_available=copies, **kwargs,
+    )
+
+
+class IsolatedCachesMixin:
+    # Each test starts with empty shared and in-process caches
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        caches['ratelimit'].clear()
+        two_tier_cache.local.clear()
+        local_sessions.clear()
+        search_cache.lru.clear()
+        search_cache.metrics.reset()
+        typeahead_index.clear()
+
+
+@override_settings(CACHES=TEST_CACHES, RATE_LIMITS={})
+class LibraryTestCase(IsolatedCachesMixin, TestCase):
+    pass
+
+
+@override_settings(CACHES=TEST_CACHES, RATE_LIMITS={})
+class LibraryTransactionTestCase(IsolatedCachesMixin, TransactionTestCase):
+    # For code that reads the database from other threads
+    pass
+
+
+class EstimatedCountPaginatorTests(LibraryTestCase):
+    class Paginator(EstimatedCountPaginator):
+        estimate_threshold = 10
+
+    def setUp(self):
+        super().setUp()
+        for number in range(40):
+            make_book(title=f'Book {number}')
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE "{PrintedBook._meta.db_table}"')
+
+    def test_counts_exactly_without_statistics(self):
+        paginator = self.Paginator(PrintedBook.objects.order_by('pk'), 10)
+        self.assertEqual(paginator.count, 40)
+        self.assertFalse(paginator.estimated)
+
+    def test_estimates_from_sqlite_stat1(self):
+        self.analyze()
+        make_book(title='Added after ANALYZE')
+        paginator = self.Paginator(PrintedBook.objects.order_by('pk'), 10)
+        self.assertEqual(paginator.count, 40)
+        self.assertTrue(paginator.estimated)
+
+    def test_falls_back_to_exact_count_past_the_rows(self):
+        self.analyze()
+        # Deleted after ANALYZE, like archive_loans leaving low pks behind
+        PrintedBook.objects.filter(pk__in=PrintedBook.objects.order_by('pk').values('pk')[5:35]).delete()
+        paginator = self.Paginator(PrintedBook.objects.order_by('pk'), 10)
+        self.assertEqual(paginator.num_pages, 4)
+        with self.assertRaises(EmptyPage):
+            paginator.page(3)
+        self.assertEqual(paginator.count, 10)
+        self.assertEqual(paginator.num_pages, 1)
+
+    def test_last_page_is_exact(self):
+        self.analyze()
+        make_book(title='Added after ANALYZE')
+        paginator = self.Paginator(PrintedBook.objects.order_by('pk'), 10)
+        page = paginator.page(4)
+        self.assertEqual(paginator.count, 41)
+        self.assertEqual(len(page), 10)
+        self.assertTrue(page.has_next())
+
+
+class WarmCachesTests(LibraryTransactionTestCase):
+    def test_command_warms_shared_stages_only(self):
+        make_book(genre='Science')
+        out = io.StringIO()
+        call_command('warm_caches', stdout=out)
+        self.assertIn('Warmed 3/3 stages', out.getvalue())
+        self.assertNotIn('typeahead', out.getvalue())
+        with self.assertNumQueries(0):
+            self.assertIn('Science', BookExplorerService().get_all_genres())
+
+    def test_worker_warms_in_process_stages(self):
+        make_book(title='Foundation')
+        results = warm_worker()
+        self.assertEqual(sorted(name for name, _, error in results if error is None), ['templates', 'typeahead'])
+        self.assertTrue(typeahead_index.built)
+
+    def test_genre_list_logs_instead_of_printing(self):
+        make_book(genre='Science')
+        with contextlib.redirect_stdout(io.StringIO()) as out, self.assertLogs('library.services', 'DEBUG'):
+            BookExplorerService().get_all_genres()
+        self.assertEqual(out.getvalue(), '')
+
+
+class HomeSectionsTests(LibraryTestCase):
+    def test_trending_status_follows_borrows_after_caching(self):
+        book = make_book(copies=2)
+        service = LibraryService()
+        service.borrow_item(make_user('alice'), book)
+        self.assertEqual(service.get_home_sections()['trending'][0].copies_available, 1)
+
+        # Only the circulation tag is bumped, so the cached sections stay
+        with self.captureOnCommitCallbacks(execute=True):
+            service.borrow_item(make_user('bob'), book)
+        self.assertEqual(service.get_home_sections()['trending'][0].copies_available, 1)
+
+        self.client.force_login(make_user('carol'))
+        trending = self.client.get(reverse('home')).context['trending']
+        self.assertEqual([(card.id, card.copies_available, card.status) for card in trending],
+                         [(book.id, 0, 'Unavailable')])
+
+
+class RateLimitTests(LibraryTestCase):
+    def test_in_flight_counter_is_atomic(self):
+        counter = ratelimit.InFlightCounter()
+        barrier = threading.Barrier(16)
+
+        def enter():
+            barrier.wait()
+            return counter.enter('slot', 2)
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            admitted = list(pool.map(lambda _: enter(), range(16)))
+        self.assertEqual(admitted.count(True), 2)
+        self.assertEqual(counter.count('slot'), 2)
+        counter.leave('slot')
+        counter.leave('slot')
+        self.assertEqual(counter.count('slot'), 0)
+        self.assertTrue(counter.enter('slot', 2))
+
+    @override_settings(RATE_LIMIT_WORKERS=4)
+    def test_cap_is_split_between_workers(self):
+        self.assertEqual(ratelimit.process_limit(8), 2)
+        self.assertEqual(ratelimit.process_limit(2), 1)
+
+    @override_settings(RATE_LIMITS={'borrow_batch': {'concurrency': 2}}, RATE_LIMIT_WORKERS=1)
+    def test_concurrency_cap_rejects_and_releases(self):
+        self.client.force_login(make_user('alice'))
+        slot = 'inflight:borrow_batch'
+        ratelimit.in_flight.enter(slot, 2)
+        ratelimit.in_flight.enter(slot, 2)
+        try:
+            response = self.client.post(reverse('borrow_batch'), {'items': []})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+        finally:
+            ratelimit.in_flight.leave(slot)
+            ratelimit.in_flight.leave(slot)
+        self.assertEqual(self.client.post(reverse('borrow_batch'), {'items': []}).status_code, 200)
+        # The slot was given back after the response
+        self.assertEqual(ratelimit.in_flight.count(slot), 0)
+
+    @override_settings(RATE_LIMITS={'search_items': {'user_rate': 0.001, 'user_burst': 2}})
+    def test_user_bucket_returns_429(self):
+        self.client.force_login(make_user('alice'))
+        statuses = [self.client.get(reverse('search_items')).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_bucket_cache_only_culls_expired_buckets(self):
+        with tempfile.TemporaryDirectory() as location:
+            cache = ExpiringFileBasedCache(location, {'OPTIONS': {'MAX_ENTRIES': 3}})
+            for n in range(3):
+                self.assertEqual(ratelimit.take_token(cache, f'bucket:{n}', rate=0.001, burst=1), 0)
+            cache.set('bucket:gone', (0, 0), timeout=-1)
+            # Past MAX_ENTRIES: the expired bucket goes, the live ones all stay empty
+            self.assertEqual(ratelimit.take_token(cache, 'bucket:3', rate=0.001, burst=1), 0)
+            self.assertEqual(len(os.listdir(location)), 4)
+            for n in range(4):
+                self.assertGreater(ratelimit.take_token(cache, f'bucket:{n}', rate=0.001, burst=1), 0)
+
+
+class LoanSnapshotTests(LibraryTestCase):
+    def test_loans_carry_item_snapshot_for_aggregation(self):
+        dune = make_book(title='Dune', genre='Fiction', copies=5)
+        cosmos = make_book(title='Cosmos', genre='Science', copies=5)
+        service = LibraryService()
+        for name in ('alice', 'bob'):
+            service.borrow_item(make_user(name), dune)
+        service.borrow_items(make_user('carol'), [dune, cosmos])
+
+        loan = BorrowingHistory.objects.filter(object_id=cosmos.id).get()
+        self.assertEqual((loan.item_title, loan.item_genre, loan.item_type), ('Cosmos', 'Science', 'printedbook'))
+        sections = service.get_home_sections()
+        self.assertEqual(sections['most_borrowed'], [{'title': 'Dune', 'total': 3}, {'title': 'Cosmos', 'total': 1}])
+        self.assertEqual(sections['popular_genres'], [{'genre': 'Fiction', 'total': 3}, {'genre': 'Science', 'total': 1}])
+        self.assertEqual([(card.type, card.id) for card in sections['trending']],
+                         [('printedbook', dune.id), ('printedbook', cosmos.id)])
+
+    def test_history_page_renders_loans_from_their_snapshot(self):
+        books = [make_book(title=f'Book {number}', copies=5) for number in range(4)]
+        user = make_user('alice', FacultyProfile, 'Faculty')
+        service = LibraryService()
+        self.client.force_login(user)
+        url = reverse('history')
+
+        def queries_for_page():
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            return response, len(queries)
+
+        service.borrow_item(user, books[0])
+        _, one_loan = queries_for_page()
+        service.borrow_items(user, books[1:])
+        response, four_loans = queries_for_page()
+        self.assertEqual(four_loans, one_loan)
+        return_url = reverse('return_item', kwargs={'item_type': 'printedbook', 'item_id': books[3].id})
+        self.assertContains(response, 'Book 3')
+        self.assertContains(response, f'action="{return_url}"')
+
+
+@override_settings(STREAM_RESULTS_THRESHOLD=2)
+class StreamedResponseTests(LibraryTestCase):
+    def test_streamed_page_shell_is_flushed_through_gzip(self):
+        for number in range(5):
+            make_book(title=f'Stream {number}')
+        self.client.force_login(make_user('alice'))
+        response = self.client.get(reverse('search_items'), {'q': 'stream'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = iter(response.streaming_content)
+        shell = decompressor.decompress(next(chunks)).decode()
+        # The whole shell is readable before any row has been compressed
+        self.assertIn('<body', shell)
+        self.assertNotIn('Stream 0', shell)
+        rest = b''.join(decompressor.decompress(chunk) for chunk in chunks) + decompressor.flush()
+        self.assertEqual(rest.decode().count('Stream '), 5)
+        self.assertTrue(decompressor.eof)
+
+    def test_page_etag_gives_not_modified(self):
+        make_book(title='Stream')
+        self.client.force_login(make_user('alice'))
+        url = reverse('history')
+        # The first page sets the CSRF cookie, which is part of the ETag
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            LibraryService().borrow_item(User.objects.get(username='alice'), PrintedBook.objects.get())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_page_etag_sees_tag_bumps_from_other_workers(self):
+        self.client.force_login(make_user('alice'))
+        url = reverse('history')
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        # Another worker bumps the tag: only the shared tier hears about it,
+        # while this process still holds the old version locally
+        two_tier_cache.shared.set(f'cache_tag:{CIRCULATION_TAG}', time.time_ns(), None)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class BranchShelfTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        # One copy on no shelf, two on North's
+        self.book = make_book(copies=1)
+        call_command('branch_inventory', 'north', f'{self.book.id}=2', name='North', stdout=io.StringIO())
+        self.service = LibraryService()
+
+    def shelf(self):
+        return BranchCopies.objects.get(branch_id='north', printed_book=self.book).copies_available
+
+    def total(self):
+        self.book.refresh_from_db()
+        return self.book.copies_available
+
+    def test_every_borrow_path_keeps_shelves_within_the_total(self):
+        self.assertEqual((self.total(), self.shelf()), (3, 2))
+        alice, bob, carol = make_user('alice'), make_user('bob'), make_user('carol')
+
+        self.assertTrue(self.service.borrow_item(alice, self.book)[0])
+        self.assertEqual((self.total(), self.shelf()), (2, 1))
+        [(_, success, _)] = self.service.borrow_items(bob, [self.book])
+        self.assertTrue(success)
+        self.assertEqual((self.total(), self.shelf()), (1, 0))
+        # No shelf has one left, so the copy on no shelf goes out
+        self.assertTrue(self.service.borrow_item(carol, self.book)[0])
+        self.assertEqual((self.total(), self.shelf()), (0, 0))
+        self.assertEqual(
+            sorted(BorrowingHistory.objects.values_list('user__username', 'branch_id')),
+            [('alice', 'north'), ('bob', 'north'), ('carol', None)],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.return_items(bob, [self.book])
+            self.service.return_item(carol, self.book)
+        self.assertEqual((self.total(), self.shelf()), (2, 1))
+
+    def test_refused_borrows_leave_the_shelves_alone(self):
+        alice = make_user('alice')
+        self.service.borrow_item(alice, self.book)
+        with mock.patch.object(branches, 'take_copies') as take_copies:
+            self.assertEqual(self.service.borrow_item(alice, self.book)[1], "Item already borrowed by this user.")
+            [(_, success, _)] = self.service.borrow_items(alice, [self.book])
+        self.assertFalse(success)
+        take_copies.assert_not_called()
+        self.assertEqual((self.total(), self.shelf()), (2, 1))
+
+    def test_loans_overtaken_by_a_concurrent_borrow_put_the_shelf_copy_back(self):
+        alice = make_user('alice')
+        # Planned before another borrow took the last copy off the total
+        with mock.patch.object(LibraryService, '_plan_borrows', return_value=([(self.book, True, '')], None)):
+            PrintedBook.objects.filter(id=self.book.id).update(copies_available=0)
+            self.assertEqual(self.service.borrow_item(alice, self.book), (False, "No copies available."))
+        self.assertEqual(self.shelf(), 2)
+
+    def test_batch_borrow_takes_copies_with_one_statement_per_branch(self):
+        books = [self.book] + [make_book(f'Book {n}') for n in range(3)]
+        call_command('branch_inventory', 'north', *[f'{book.id}=1' for book in books[1:]], stdout=io.StringIO())
+
+        def borrow(user, items):
+            with CaptureQueriesContext(connection) as queries:
+                results = self.service.borrow_items(user, items)
+            self.assertTrue(all(success for _, success, _ in results))
+            return len(queries)
+
+        # Faculty, so three loans fit
+        alice, bob = make_user('alice', FacultyProfile, 'Faculty'), make_user('bob', FacultyProfile, 'Faculty')
+        self.assertEqual(borrow(alice, books[:1]), borrow(bob, books[1:]))
+        self.assertEqual(
+            sorted(BranchCopies.objects.values_list('copies_available', flat=True)), [0, 0, 0, 1],
+        )
+
+    def test_inventory_rejects_negative_counts(self):
+        with self.assertRaisesMessage(CommandError, "can't be negative"):
+            call_command('branch_inventory', 'north', f'{self.book.id}=-1', stdout=io.StringIO())
+        self.assertEqual((self.total(), self.shelf()), (3, 2))
+
+
+class BranchPutBackTests(LibraryTransactionTestCase):
+    # Outside a test transaction, so atomic_with_retry can retry
+    def test_put_back_retries_while_the_branch_database_is_busy(self):
+        book = make_book(copies=0)
+        call_command('branch_inventory', 'north', f'{book.id}=1', name='North', stdout=io.StringIO())
+        update = QuerySet.update
+        calls = []
+
+        def busy_once(queryset, **kwargs):
+            calls.append(queryset.model)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', busy_once), mock.patch('time.sleep'):
+            branches.put_back('north', book.id)
+        self.assertEqual(calls, [BranchCopies, BranchCopies])
+        self.assertEqual(BranchCopies.objects.get(printed_book=book).copies_available, 2)
+
+
+class LoanStateTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = LibraryService()
+        self.alice = make_user('alice')
+
+    def state(self):
+        return UserLoanState.objects.get(user=self.alice)
+
+    def test_fines_only_block_borrowing_when_a_limit_is_set(self):
+        self.service.get_loan_state(self.alice)
+        UserLoanState.objects.filter(user=self.alice).update(outstanding_fines=60)
+        with override_settings(FINE_BORROW_LIMIT=50):
+            success, message = self.service.borrow_item(self.alice, make_book('Dune'))
+        self.assertFalse(success)
+        self.assertIn("Rs.60.00", message)
+        self.assertTrue(self.service.borrow_item(self.alice, make_book('Emma'))[0])
+
+    def test_returns_only_uncount_loans_the_last_reconcile_counted(self):
+        dune, emma = make_book('Dune'), make_book('Emma')
+        self.service.borrow_items(self.alice, [dune, emma])
+        today = date.today()
+        # The last reconcile, ten days ago, counted Dune; Emma fell overdue since
+        BorrowingHistory.objects.filter(item_title='Dune').update(due_date=today - timedelta(days=20))
+        BorrowingHistory.objects.filter(item_title='Emma').update(due_date=today - timedelta(days=5))
+        UserLoanState.objects.filter(user=self.alice).update(
+            overdue_loans=1, overdue_as_of=today - timedelta(days=10),
+        )
+
+        self.service.return_item(self.alice, emma)
+        self.assertEqual((self.state().active_loans, self.state().overdue_loans), (1, 1))
+
+        self.service.borrow_item(self.alice, emma)
+        BorrowingHistory.objects.filter(item_title='Emma', return_date__isnull=True).update(
+            due_date=today - timedelta(days=1),
+        )
+        call_command('reconcile_loan_states', stdout=io.StringIO())
+        self.assertEqual((self.state().overdue_loans, self.state().overdue_as_of), (2, today))
+        self.service.return_items(self.alice, [dune, emma])
+        self.assertEqual((self.state().active_loans, self.state().overdue_loans), (0, 0))
+
+
+@override_settings(SSE_ENABLED=True, SSE_HEARTBEAT_SECONDS=1)
+class AvailabilityEventsTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = make_user('alice')
+        self.book = make_book(copies=1)
+        self.url = f"{reverse('availability_events')}?books={self.book.id}"
+
+    def test_wsgi_requests_are_refused(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(self.url).status_code, 501)
+        with override_settings(SSE_ENABLED=False):
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    async def test_asgi_stream_sends_counts_and_changes_uncompressed(self):
+        await self.async_client.aforce_login(self.alice)
+        response = await self.async_client.get(self.url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        events = aiter(response.streaming_content)
+        self.assertTrue((await anext(events)).startswith(b'retry:'))
+        self.assertIn(b'"copies": 1', await anext(events))
+        self.assertEqual(availability_hub.watched([self.book.id]), {self.book.id})
+        availability_hub.publish(self.book.id, 0)
+        self.assertIn(b'"copies": 0, "available": false', await anext(events))
+
+    def test_explore_swaps_borrow_and_reserve_only_when_enabled(self):
+        self.client.force_login(self.alice)
+        page = self.client.get(reverse('explore'), {'genre': 'Fiction'}).content.decode()
+        self.assertIn('new EventSource', page)
+        self.assertIn(f'data-book-id="{self.book.id}"', page)
+        self.assertIn('data-status="Available">', page)
+        self.assertIn('data-status="Unavailable" hidden>', page)
+        with override_settings(SSE_ENABLED=False):
+            page = self.client.get(reverse('explore'), {'genre': 'Fiction'}).content.decode()
+        self.assertNotIn('new EventSource', page)
+
+
+class SQLiteBackendTests(LibraryTransactionTestCase):
+    # Outside a test transaction, so atomic_with_retry can retry
+    def flaky(self, errors):
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return 'written'
+        return calls, write
+
+    def test_connections_get_the_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_busy_writes_are_retried(self):
+        calls, write = self.flaky([OperationalError('database is locked')] * 2)
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(atomic_with_retry(write)(), 'written')
+        self.assertEqual((len(calls), sleep.call_count), (3, 2))
+
+    def test_retries_give_up_and_other_errors_propagate(self):
+        calls, write = self.flaky([OperationalError('database is locked')] * 5)
+        with mock.patch('time.sleep'), self.assertRaisesMessage(OperationalError, 'locked'):
+            atomic_with_retry(write, attempts=3)()
+        self.assertEqual(len(calls), 3)
+
+        calls, write = self.flaky([OperationalError('no such table: library_loan')])
+        with self.assertRaisesMessage(OperationalError, 'no such table'):
+            atomic_with_retry(write)()
+        self.assertEqual(len(calls), 1)
+
+
+class ReplicaRouterTests(LibraryTestCase):
+    @mock.patch('library.routers.replica_available', return_value=True)
+    def test_only_analytics_reads_go_to_the_replica(self, available):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(PrintedBook))
+        with replica_reads():
+            self.assertEqual(router.db_for_read(PrintedBook), 'replica')
+        self.assertEqual(router.db_for_write(PrintedBook), 'default')
+
+    @mock.patch('library.routers.replica_available', return_value=True)
+    def test_requests_that_write_read_their_writes(self, available):
+        router = ReplicaRouter()
+        with track_request() as state, replica_reads():
+            # Saving the session doesn't pin the request
+            router.db_for_write(Session)
+            self.assertEqual(router.db_for_read(PrintedBook), 'replica')
+            router.db_for_write(BorrowingHistory)
+            self.assertEqual(router.db_for_read(PrintedBook), 'default')
+        self.assertTrue(state['wrote'])
+        with track_request(pinned=True), replica_reads():
+            self.assertEqual(router.db_for_read(PrintedBook), 'default')
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        book = make_book()
+        self.client.force_login(make_user('alice'))
+        self.assertNotIn(PIN_COOKIE, self.client.get(reverse('home')).cookies)
+        response = self.client.post(reverse('borrow_item', kwargs={'item_type': 'printedbook', 'item_id': book.id}))
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+
+class TypeaheadTests(LibraryTestCase):
+    def titles(self, prefix, **kwargs):
+        return [result['text'] for result in typeahead_index.complete(prefix, **kwargs) if result['field'] == 'title']
+
+    def test_completes_prefixes_and_later_words_most_borrowed_first(self):
+        make_book('Harry Potter and the Goblet of Fire')
+        stone = make_book('Harry Potter and the Philosopher\'s Stone')
+        self.assertEqual(self.titles('zz'), [])
+        self.assertEqual(len(self.titles('harry p')), 2)
+        LibraryService().borrow_item(make_user('alice'), stone)
+        self.assertEqual(self.titles('POTTER')[0], "Harry Potter and the Philosopher's Stone")
+
+        # Kept current by signals after the first build
+        make_book('Harry Hole', author='Jo Nesbo')
+        self.assertIn('Harry Hole', self.titles('harry'))
+        self.assertEqual(typeahead_index.complete('nesb')[0]['text'], 'Jo Nesbo')
+
+    def test_guests_get_no_research_papers(self):
+        ResearchPaper.objects.create(
+            title='Dune ecology', author='Ada', genre='Science', publication_date=date(2000, 1, 1),
+            doi='10.1/dune', access_level='Open',
+        )
+        make_book('Dune')
+        self.client.force_login(make_user('guest', GuestProfile, 'Guest'))
+        results = self.client.get(reverse('typeahead'), {'q': 'dune'}).json()['results']
+        self.assertEqual([result['text'] for result in results], ['Dune'])
+
+
+class FuzzySearchTests(LibraryTestCase):
+    def test_similarity_matches_the_closest_words(self):
+        self.assertEqual(similarity('dostoevsky', 'Fyodor Dostoevsky'), 1.0)
+        self.assertGreater(similarity('dostoyevsky', 'Fyodor Dostoevsky'), FUZZY_THRESHOLD)
+        self.assertLess(similarity('dostoyevsky', 'Frank Herbert'), FUZZY_THRESHOLD)
+
+    def test_misspelled_titles_and_authors_are_found(self):
+        crime = make_book('Crime and Punishment', author='Fyodor Dostoevsky')
+        make_book('Dune')
+        crime_key = (TYPE_CODES['printedbook'], crime.id)
+        self.assertEqual(fuzzy_keys('dostoyevsky', [PrintedBook]), [crime_key])
+        self.assertEqual(fuzzy_keys('crme and punishmnt', [PrintedBook]), [crime_key])
+        self.assertEqual(fuzzy_keys('crime', [EBook]), [])
+        # Renames reach the trigram index
+        PrintedBook.objects.filter(id=crime.id).update(title='The Idiot')
+        self.assertEqual(fuzzy_keys('punishment', [PrintedBook]), [])
+
+
+class BorrowLimitTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = LibraryService()
+        self.alice = make_user('alice')
+
+    def test_state_is_seeded_from_history_and_enforces_the_limit(self):
+        dune, emma, ulysses = make_book('Dune'), make_book('Emma'), make_book('Ulysses')
+        # A loan made before the account had a loan state
+        BorrowingHistory.objects.create(user=self.alice, item=dune)
+        self.assertFalse(UserLoanState.objects.filter(user=self.alice).exists())
+        self.assertTrue(self.service.borrow_item(self.alice, emma)[0])
+        state = UserLoanState.objects.get(user=self.alice)
+        self.assertEqual((state.active_loans, state.borrowing_limit, state.loans_left), (2, 2, 0))
+        self.assertFalse(self.service.can_user_borrow(self.alice))
+        self.assertFalse(self.service.borrow_item(self.alice, ulysses)[0])
+
+        self.service.return_item(self.alice, dune)
+        self.assertTrue(self.service.can_user_borrow(self.alice))
+        self.assertTrue(self.service.borrow_item(self.alice, ulysses)[0])
+
+    def test_reconcile_repairs_drift(self):
+        self.service.borrow_item(self.alice, make_book('Dune'))
+        UserLoanState.objects.filter(user=self.alice).update(active_loans=2, lifetime_loans=0)
+        out = io.StringIO()
+        call_command('reconcile_loan_states', '--dry-run', stdout=out)
+        self.assertIn("Would repair 1", out.getvalue())
+        self.assertEqual(UserLoanState.objects.get(user=self.alice).active_loans, 2)
+        call_command('reconcile_loan_states', stdout=io.StringIO())
+        state = UserLoanState.objects.get(user=self.alice)
+        self.assertEqual((state.active_loans, state.lifetime_loans), (1, 1))
+
+
+class BatchCheckoutTests(LibraryTestCase):
+    def test_batch_borrow_and_return_report_each_item(self):
+        dune, emma, gone = make_book('Dune'), make_book('Emma'), make_book('Ulysses', copies=0)
+        alice = make_user('alice')
+        self.client.force_login(alice)
+        items = [f'printedbook:{dune.id}', f'printedbook:{gone.id}', f'printedbook:{emma.id}', 'ebook:999', 'map:1']
+        results = self.client.post(reverse('borrow_batch'), {'items': items}).json()['results']
+        self.assertEqual([(result['item'], result['success']) for result in results], [
+            (f'printedbook:{dune.id}', True), (f'printedbook:{gone.id}', False), (f'printedbook:{emma.id}', True),
+            # Unresolvable items are reported last
+            ('map:1', False), ('ebook:999', False),
+        ])
+        self.assertEqual(UserLoanState.objects.get(user=alice).active_loans, 2)
+        self.assertEqual(PrintedBook.objects.get(id=dune.id).copies_available, 0)
+
+        # Due five days ago, so returning it charges a fine
+        BorrowingHistory.objects.filter(object_id=dune.id).update(due_date=date.today() - timedelta(days=5))
+        results = self.client.post(reverse('return_batch'), {'items': [f'printedbook:{dune.id}', f'printedbook:{emma.id}']}).json()['results']
+        self.assertTrue(all(result['success'] for result in results))
+        state = UserLoanState.objects.get(user=alice)
+        self.assertEqual(state.active_loans, 0)
+        self.assertGreater(state.outstanding_fines, 0)
+        self.assertEqual(PrintedBook.objects.get(id=dune.id).copies_available, 1)
+
+    def test_guests_and_oversized_batches_are_refused(self):
+        self.client.force_login(make_user('guest', GuestProfile, 'Guest'))
+        self.assertEqual(self.client.post(reverse('borrow_batch'), {'items': ['ebook:1']}).status_code, 403)
+        items = [f'ebook:{item_id}' for item_id in range(MAX_BATCH_ITEMS + 1)]
+        self.assertEqual(self.client.post(reverse('return_batch'), {'items': items}).status_code, 400)
+
+
+class ProvisionUsersTests(LibraryTestCase):
+    def test_roster_creates_users_profiles_and_loan_states_once(self):
+        make_user('alice')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as roster:
+            roster.write(
+                "username,email,password,user_type\n"
+                "alice,alice@example.com,,Student\n"
+                "bob,bob@example.com,s3cret-pass,Faculty\n"
+                "carol,,,Wizard\n"
+                "dave,,,Guest\n"
+            )
+            roster.flush()
+            out, err = io.StringIO(), io.StringIO()
+            call_command('provision_users', roster.name, workers=1, stdout=out, stderr=err)
+        self.assertIn("Created 2 users, skipped 1 existing", out.getvalue())
+        self.assertIn("unknown user_type 'Wizard'", err.getvalue())
+
+        bob = User.objects.get(username='bob')
+        self.assertTrue(bob.check_password('s3cret-pass'))
+        self.assertFalse(User.objects.get(username='dave').has_usable_password())
+        self.assertEqual(LibraryService().get_user_type(bob), 'Faculty')
+        self.assertEqual(UserLoanState.objects.get(user=bob).borrowing_limit, 5)
+
+
+class PrecompressedStaticTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        settings_override = override_settings(STATIC_ROOT=self.root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_hashed_assets_are_served_precompressed_and_immutable(self):
+        with open(os.path.join(self.root.name, 'staticfiles.json')) as manifest:
+            hashed = json.load(manifest)['paths']['css/explore.css']
+        with open(os.path.join(self.root.name, hashed), 'rb') as asset:
+            original = asset.read()
+
+        response = self.client.get(f'/static/{hashed}', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), original)
+
+        response = self.client.get('/static/css/explore.css')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(b''.join(response.streaming_content), original)
+
+    def test_plain_names_until_collectstatic_has_run(self):
+        self.assertRegex(static('css/base.css'), r'^/static/css/base\.[0-9a-f]{12}\.css$')
+        with tempfile.TemporaryDirectory() as empty, override_settings(STATIC_ROOT=empty):
+            self.assertEqual(static('css/base.css'), '/static/css/base.css')
+
+
+class CachedSessionAndUserTests(LibraryTestCase):
+    def test_users_are_cached_until_saved(self):
+        alice = make_user('alice')
+        backend = CachedModelBackend()
+        first = backend.get_user(alice.id)
+        with self.assertNumQueries(0):
+            second = backend.get_user(alice.id)
+        self.assertEqual(second, alice)
+        self.assertIsNot(second, backend.get_user(alice.id))
+
+        alice.is_active = False
+        alice.save()
+        self.assertIsNone(backend.get_user(alice.id))
+        self.assertTrue(first.is_active)
+
+    def test_sessions_are_read_from_the_local_tier(self):
+        session = SessionStore()
+        session['cart'] = ['printedbook:1']
+        session.create()
+        caches['default'].clear()
+        with self.assertNumQueries(0):
+            loaded = SessionStore(session.session_key)
+            self.assertEqual(loaded['cart'], ['printedbook:1'])
+        # Changing the loaded copy doesn't change the cached one
+        loaded['cart'].append('ebook:2')
+        self.assertEqual(SessionStore(session.session_key)['cart'], ['printedbook:1'])
+
+        session.delete()
+        self.assertNotIn('cart', SessionStore(session.session_key))
+
+
+class ProfilingTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+        settings_override = override_settings(PROFILING={
+            'ENABLED': True, 'SAMPLE_RATE': 0.0, 'HEADER': 'X-Profile', 'INTERVAL': 0.001,
+            'OUTPUT_DIR': self.output_dir.name,
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def profiles(self):
+        return glob.glob(os.path.join(self.output_dir.name, 'search_items', '*.sql.json'))
+
+    def test_staff_requests_with_the_header_are_profiled(self):
+        make_book('Dune')
+        alice = make_user('alice')
+        self.client.force_login(alice)
+        self.client.get(reverse('search_items'), {'q': 'dune'}, headers={'X-Profile': '1'})
+        self.assertEqual(self.profiles(), [])
+
+        alice.is_staff = True
+        alice.save()
+        self.client.get(reverse('search_items'), {'q': 'dune'}, headers={'X-Profile': '1'})
+        [profile] = self.profiles()
+        with open(profile) as sidecar:
+            queries = json.load(sidecar)['queries']
+        self.assertTrue(any(sql.startswith('SELECT "library_printedbook"') for sql in queries))
+        self.assertTrue(os.path.exists(profile.replace('.sql.json', '.folded')))
+        out = io.StringIO()
+        call_command('profile_report', view='search_items', stdout=out)
+        self.assertIn('library_printedbook', out.getvalue())
+
+    def test_sql_is_normalized_without_literals(self):
+        self.assertEqual(
+            normalize_sql("SELECT *\n  FROM t WHERE id = 12 AND name = 'O''Brien';"),
+            "SELECT * FROM t WHERE id = ? AND name = ?,",
+        )
+
+
+class ArchiveLoansTests(LibraryTestCase):
+    def test_old_returned_loans_move_to_the_archive(self):
+        alice = make_user('alice')
+        dune, emma, ulysses = make_book('Dune'), make_book('Emma'), make_book('Ulysses')
+        long_ago = date.today() - timedelta(days=400)
+        old = BorrowingHistory.objects.create(user=alice, item=dune, borrow_date=long_ago - timedelta(days=10))
+        recent = BorrowingHistory.objects.create(user=alice, item=emma)
+        BorrowingHistory.objects.create(user=alice, item=ulysses)
+        BorrowingHistory.objects.filter(id=old.id).update(return_date=long_ago, fine=5)
+        BorrowingHistory.objects.filter(id=recent.id).update(return_date=date.today())
+
+        out = io.StringIO()
+        call_command('archive_loans', '--dry-run', stdout=out)
+        self.assertIn("Would archive 1 loans", out.getvalue())
+        call_command('archive_loans', days=365, batch_size=1, stdout=io.StringIO())
+        self.assertFalse(BorrowingHistory.objects.filter(id=old.id).exists())
+        archived = BorrowingHistoryArchive.objects.get(id=old.id)
+        self.assertEqual((archived.item_title, archived.fine), ('Dune', 5))
+
+        service = LibraryService()
+        self.assertEqual([loan.item_title for loan in service.get_borrowing_history(alice)], ['Emma', 'Ulysses'])
+        self.assertEqual(
+            [loan.item_title for loan in service.get_borrowing_history(alice, include_archived=True)],
+            ['Dune', 'Emma', 'Ulysses'],
+        )
+        # Archived loans still count towards the account summary
+        state = service.get_loan_state(alice)
+        self.assertEqual((state.lifetime_loans, state.outstanding_fines), (3, 5))
+
+
+class DueRemindersTests(LibraryTestCase):
+    def loan(self, user, title, due_in, returned=False):
+        loan = BorrowingHistory.objects.create(user=user, item=make_book(title))
+        BorrowingHistory.objects.filter(id=loan.id).update(
+            due_date=date.today() + timedelta(days=due_in),
+            return_date=date.today() if returned else None,
+        )
+
+    def test_one_digest_per_user_with_due_and_overdue_loans(self):
+        alice, bob, carol = make_user('alice'), make_user('bob'), make_user('carol')
+        carol.email = ''
+        carol.save()
+        self.loan(alice, 'Dune', due_in=2)
+        self.loan(alice, 'Emma', due_in=-3)
+        self.loan(alice, 'Ulysses', due_in=-1, returned=True)
+        # Reminded about yesterday, when it was two days away
+        self.loan(bob, 'Beloved', due_in=1)
+        self.loan(carol, 'Middlemarch', due_in=-1)
+
+        out = io.StringIO()
+        call_command('send_due_reminders', '--dry-run', stdout=out)
+        self.assertIn("Built 1 reminder emails", out.getvalue())
+        self.assertEqual(mail.outbox, [])
+
+        call_command('send_due_reminders', days=2, stdout=io.StringIO())
+        [message] = mail.outbox
+        self.assertEqual((message.to, message.subject), (['alice@example.com'], "Overdue items at Nexus Library"))
+        self.assertIn("Emma (due", message.body)
+        self.assertIn("3 days overdue", message.body)
+        self.assertIn("Dune (due", message.body)
+        self.assertNotIn("Ulysses", message.body)
+
+
+class BooksByGenreTests(LibraryTestCase):
+    def titles(self, genre, user=None):
+        return sorted(card.title for card in BookExplorerService().get_books_by_genre(genre, user))
+
+    def test_hides_only_the_users_own_open_loans_of_that_item_type(self):
+        alice, bob = make_user('alice'), make_user('bob')
+        dune, emma = make_book('Dune'), make_book('Emma')
+        # Same id as Dune, different type
+        ebook = EBook.objects.create(
+            id=dune.id, title='Dune (ebook)', author='Frank Herbert', genre='fiction',
+            publication_date=date(2000, 1, 1), file_url='https://example.com/dune.epub', file_size=1,
+        )
+        service = LibraryService()
+        service.borrow_item(alice, dune)
+        service.borrow_item(alice, ebook)
+        service.return_item(alice, ebook)
+        service.borrow_item(bob, emma)
+
+        self.assertEqual(self.titles('FICTION', alice), ['Dune (ebook)', 'Emma'])
+        self.assertEqual(self.titles('Fiction', bob), ['Dune', 'Dune (ebook)'])
+        self.assertEqual(self.titles('Fiction'), ['Dune', 'Dune (ebook)', 'Emma'])
+
+
+class SearchCacheTests(LibraryTestCase):
+    def test_normalized_queries_share_results_until_the_catalog_changes(self):
+        dune = make_book('Dune')
+        models = [EBook, PrintedBook]
+        self.assertEqual(search_cache.search('Dune', 'keyword', models), [('printedbook', dune.id)])
+        with self.assertNumQueries(0):
+            self.assertEqual(search_cache.search('  dUNE ', 'keyword', models), [('printedbook', dune.id)])
+        self.assertEqual(search_cache.metrics.snapshot(), {'misses': 1, 'hits': 1})
+        # Guests see other item types, so get their own entry
+        search_cache.search('dune', 'keyword', [EBook])
+        self.assertEqual(search_cache.metrics.snapshot()['misses'], 2)
+
+        messiah = make_book('Dune Messiah')
+        with self.captureOnCommitCallbacks(execute=True):
+            PrintedBook.objects.filter(id=dune.id).delete()
+        self.assertEqual(search_cache.search('dune', 'keyword', models), [('printedbook', messiah.id)])
+
+
+class SimilarItemsTests(LibraryTestCase):
+    def test_similar_items_rank_shared_author_and_words_first(self):
+        dune = make_book('Dune')
+        messiah = make_book('Dune Messiah')
+        make_book('Children of Dune', genre='Science Fiction')
+        make_book('Emma', author='Jane Austen')
+        make_book('Persuasion', author='Jane Austen', genre='Romance')
+        ResearchPaper.objects.create(
+            title='Dune ecology', author='Frank Herbert', genre='Fiction', publication_date=date(2000, 1, 1),
+            doi='10.1/dune', access_level='Open',
+        )
+        call_command('build_similar_items', top_k=3, stdout=io.StringIO())
+
+        self.client.force_login(make_user('alice'))
+        url = reverse('similar_items', kwargs={'item_type': 'printedbook', 'item_id': dune.id})
+        results = self.client.get(url).json()['results']
+        self.assertEqual(results[0]['id'], messiah.id)
+        self.assertIn('researchpaper', [result['type'] for result in results])
+        self.assertNotIn('Persuasion', [result['title'] for result in results])
+
+        self.client.force_login(make_user('guest', GuestProfile, 'Guest'))
+        results = self.client.get(url).json()['results']
+        self.assertNotIn('researchpaper', [result['type'] for result in results])
+
+    def test_python_neighbors_match_cosine_similarity(self):
+        vectors = tfidf_vectors([['a', 'b'], ['a', 'b'], ['a', 'c'], ['c', 'd']])
+        # 'd' occurs once, so the last vector only keeps 'c'
+        self.assertEqual(set(vectors[3]), {'c'})
+        neighbors = _top_neighbors_python(vectors, k=2)
+        self.assertEqual([other for other, _ in neighbors[0]], [1, 2])
+        self.assertAlmostEqual(neighbors[0][0][1], 1.0)
+
+    @skipUnless(np, "NumPy is not installed")
+    def test_numpy_neighbors_match_python_neighbors(self):
+        documents = [
+            [f'word{(i * 7) % 13}', f'word{(i * 5) % 11}', f'author:{i % 9}', f'genre:{i % 4}']
+            for i in range(60)
+        ]
+        vectors = tfidf_vectors(documents)
+        expected = _top_neighbors_python(vectors, k=5)
+        # A tiny memory budget forces many blocks of rows
+        for memory in (64 * 1024 * 1024, 1000):
+            neighbors = _top_neighbors_numpy(vectors, 5, memory)
+            self.assertEqual(len(neighbors), len(expected))
+            for found, wanted in zip(neighbors, expected):
+                # Ties may come in either order, so compare the scores
+                self.assertEqual(len(found), len(wanted))
+                for (_, score), (_, wanted_score) in zip(found, wanted):
+                    self.assertAlmostEqual(score, wanted_score)
+
+
+class ItemCardTests(LibraryTestCase):
+    def test_cards_keep_key_order_and_get_per_user_status_copies(self):
+        dune, gone = make_book('Dune'), make_book('Ulysses', copies=0)
+        paper = ResearchPaper.objects.create(
+            title='Dune ecology', author='Ada', genre='Science', publication_date=date(2000, 1, 1),
+            doi='10.1/dune', access_level='Restricted',
+        )
+        alice = make_user('alice')
+        LibraryService().borrow_item(alice, dune)
+        keys = [('researchpaper', paper.id), ('printedbook', gone.id), ('ebook', 1), ('printedbook', dune.id)]
+
+        with self.assertNumQueries(2):
+            cards = load_cards(keys, [PrintedBook, ResearchPaper])
+        self.assertEqual([(card.type, card.id) for card in cards], [keys[0], keys[1], keys[3]])
+        self.assertEqual((cards[0].access_level, cards[0].type_name), ('Restricted', 'ResearchPaper'))
+        self.assertEqual(cards[2].copies_available, 0)
+
+        with self.assertNumQueries(1):
+            statuses = [card.status for card in with_status(cards, alice)]
+        self.assertEqual(statuses, ['Available', 'Unavailable', 'Borrowed'])
+        self.assertEqual([card.status for card in with_status(cards, AnonymousUser())], ['Unavailable'] * 3)
+        # The shared cards are left without a status
+        self.assertEqual({card.status for card in cards}, {''})
+
+
+class ReconcileLoanStatesTests(LibraryTransactionTestCase):
+    def test_each_batch_is_counted_and_written_in_one_transaction(self):
+        service = LibraryService()
+        users = [make_user(name) for name in ('alice', 'bob', 'carol')]
+        for user in users:
+            service.borrow_item(user, make_book(f"{user.username}'s book"))
+        UserLoanState.objects.update(active_loans=0)
+        command = reconcile_loan_states.Command()
+        expected_states = command.expected_states
+        batches = []
+
+        def counted_in_transaction(user_ids, today):
+            # A borrow committing after the count would be overwritten by it
+            batches.append((list(user_ids), connection.in_atomic_block))
+            return expected_states(user_ids, today)
+
+        with mock.patch.object(command, 'expected_states', counted_in_transaction):
+            call_command(command, batch_size=2, stdout=io.StringIO())
+        self.assertEqual(batches, [([users[0].id, users[1].id], True), ([users[2].id], True)])
+        self.assertEqual(list(UserLoanState.objects.values_list('active_loans', flat=True)), [1, 1, 1])
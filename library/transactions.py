@@ -0,0 +1,50 @@
+import random
+import time
+from functools import wraps
+
+from django.db import OperationalError, transaction
+
+BUSY_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_busy_error(exc):
+    return any(message in str(exc).lower() for message in BUSY_MESSAGES)
+
+
+def backoff_delays(attempts=5, base_delay=0.05, max_delay=1.0):
+    # Exponential backoff with full jitter so that writers which collided once
+    # don't wake up together and collide again.
+    for attempt in range(attempts - 1):
+        yield random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def atomic_with_retry(func=None, *, using=None, attempts=5, base_delay=0.05, max_delay=1.0):
+    """Run ``func`` in its own transaction, retrying it when SQLite reports SQLITE_BUSY.
+
+    When called inside an outer ``atomic`` block the outer transaction owns the
+    lock, so the call is not retried and any busy error propagates to it.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if transaction.get_connection(using).in_atomic_block:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+
+            delays = backoff_delays(attempts, base_delay, max_delay)
+            while True:
+                try:
+                    with transaction.atomic(using=using):
+                        return func(*args, **kwargs)
+                except OperationalError as exc:
+                    if not is_busy_error(exc):
+                        raise
+                    delay = next(delays, None)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
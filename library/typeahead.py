@@ -0,0 +1,270 @@
+import threading
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+
+from library.models import EBook, PrintedBook, ResearchPaper, Audiobook, BorrowingHistory, BorrowingHistoryArchive
+
+ITEM_MODELS = [EBook, PrintedBook, Audiobook, ResearchPaper]
+FIELDS = ('title', 'author')
+# Candidates kept per trie node. Larger than the number of results returned so
+# there is still enough left after hiding research papers and duplicate authors.
+NODE_CAPACITY = 32
+# Also index each title/author from its 2nd, 3rd... word so "potter" finds
+# "Harry Potter", up to this many words in.
+MAX_WORD_STARTS = 8
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def index_keys(text):
+    words = normalize(text).split(' ')
+    return {' '.join(words[i:]) for i in range(min(len(words), MAX_WORD_STARTS)) if words[i]}
+
+
+class _Node:
+    __slots__ = ('label', 'children', 'entries', 'top', 'dirty')
+
+    def __init__(self, label=''):
+        self.label = label
+        self.children = {}
+        self.entries = set()
+        self.top = []
+        self.dirty = False
+
+
+class TypeaheadIndex:
+    """In-process compressed prefix trie over item titles and authors.
+
+    Every node keeps its most borrowed completions, so a lookup is a walk down
+    at most ``len(prefix)`` edges and never touches the database. The index is
+    built on first use and then kept current by the signal handlers in
+    ``library.signals``; each worker process holds its own copy.
+
+    Entries are ``(model_name, item_id, field)`` tuples.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._reset()
+
+    def _reset(self):
+        self._root = _Node()
+        self._texts = {}
+        self._keys = {}
+        self._popularity = {}
+
+    @property
+    def built(self):
+        return self._built
+
+    def build(self):
+        popularity = {}
+        # Read from the primary: signals only cover changes made after this point
+        for loan_model in (BorrowingHistory, BorrowingHistoryArchive):
+            rows = (
+                loan_model.objects.values('content_type', 'object_id')
+                .annotate(total=Count('id'))
+            )
+            for row in rows:
+                key = (ContentType.objects.get_for_id(row['content_type']).model, row['object_id'])
+                popularity[key] = popularity.get(key, 0) + row['total']
+        items = [
+            (model._meta.model_name, item_id, title, author)
+            for model in ITEM_MODELS
+            for item_id, title, author in model.objects.values_list('id', 'title', 'author')
+        ]
+
+        with self._lock:
+            self._reset()
+            self._popularity = popularity
+            # Most borrowed first, so node lists fill in rank order and rarely re-sort
+            items.sort(key=lambda item: popularity.get(item[:2], 0), reverse=True)
+            for model_name, item_id, title, author in items:
+                self._add_item(model_name, item_id, title, author)
+            self._built = True
+
+    def clear(self):
+        """Drop the index; the next lookup rebuilds it."""
+        with self._lock:
+            self._reset()
+            self._built = False
+
+    def ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self.build()
+
+    def complete(self, prefix, limit=10, include_research_papers=True):
+        """Return up to ``limit`` completions for ``prefix``, most borrowed first."""
+        self.ensure_built()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        node = self._find(prefix)
+        if node is None:
+            return []
+        if node.dirty:
+            with self._lock:
+                self._recompute(node)
+
+        results, seen = [], set()
+        for entry in list(node.top):
+            model_name, item_id, field = entry
+            if model_name == 'researchpaper' and not include_research_papers:
+                continue
+            text = self._texts.get(entry)
+            if text is None or (field, text.lower()) in seen:
+                continue
+            seen.add((field, text.lower()))
+            results.append({'text': text, 'field': field, 'type': model_name, 'id': item_id})
+            if len(results) == limit:
+                break
+        return results
+
+    def update_item(self, item):
+        if not self._built:
+            return
+        with self._lock:
+            model_name = item._meta.model_name
+            self._remove_item(model_name, item.id)
+            self._add_item(model_name, item.id, item.title, item.author)
+
+    def remove_item(self, item):
+        if not self._built:
+            return
+        with self._lock:
+            self._remove_item(item._meta.model_name, item.id)
+            self._popularity.pop((item._meta.model_name, item.id), None)
+
+    def record_borrow(self, model_name, item_id):
+        if not self._built:
+            return
+        with self._lock:
+            key = (model_name, item_id)
+            self._popularity[key] = self._popularity.get(key, 0) + 1
+            for field in FIELDS:
+                entry = (model_name, item_id, field)
+                for path in self._paths(entry):
+                    for node in path:
+                        self._offer(node, entry)
+
+    def _score(self, entry):
+        return self._popularity.get(entry[:2], 0)
+
+    def _add_item(self, model_name, item_id, title, author):
+        for field, text in zip(FIELDS, (title, author)):
+            entry = (model_name, item_id, field)
+            self._texts[entry] = text
+            self._keys[entry] = index_keys(text)
+            for key in self._keys[entry]:
+                for node in self._insert(key, entry):
+                    self._offer(node, entry)
+
+    def _remove_item(self, model_name, item_id):
+        for field in FIELDS:
+            entry = (model_name, item_id, field)
+            for path in self._paths(entry):
+                path[-1].entries.discard(entry)
+                for node in path:
+                    if entry in node.top:
+                        # A full list may be hiding whatever ranked just below
+                        # it; rebuild that one from the subtree on next lookup.
+                        node.dirty = node.dirty or len(node.top) >= NODE_CAPACITY
+                        node.top.remove(entry)
+            self._texts.pop(entry, None)
+            self._keys.pop(entry, None)
+
+    def _offer(self, node, entry):
+        top = node.top
+        if entry not in top:
+            score = self._score(entry)
+            if top and score <= self._score(top[-1]):
+                if len(top) < NODE_CAPACITY:
+                    top.append(entry)
+                return
+            top.append(entry)
+        top.sort(key=self._score, reverse=True)
+        del top[NODE_CAPACITY:]
+
+    def _recompute(self, node):
+        entries = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            entries.update(current.entries)
+            stack.extend(current.children.values())
+        node.top = sorted(entries, key=self._score, reverse=True)[:NODE_CAPACITY]
+        node.dirty = False
+
+    def _paths(self, entry):
+        for key in self._keys.get(entry, ()):
+            path = self._walk(key)
+            if path:
+                yield path
+
+    def _walk(self, key):
+        # Path of nodes for an exact, already indexed key
+        node, i, path = self._root, 0, [self._root]
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None or not key.startswith(child.label, i):
+                return None
+            i += len(child.label)
+            node = child
+            path.append(node)
+        return path
+
+    def _find(self, prefix):
+        node, i = self._root, 0
+        while i < len(prefix):
+            child = node.children.get(prefix[i])
+            if child is None:
+                return None
+            rest = prefix[i:]
+            if rest.startswith(child.label):
+                i += len(child.label)
+                node = child
+            elif child.label.startswith(rest):
+                # The prefix ends part-way along this edge
+                return child
+            else:
+                return None
+        return node
+
+    def _insert(self, key, entry):
+        node, i, path = self._root, 0, [self._root]
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                child = _Node(key[i:])
+                node.children[key[i]] = child
+                path.append(child)
+                node = child
+                break
+            label = child.label
+            common = 0
+            limit = min(len(label), len(key) - i)
+            while common < limit and label[common] == key[i + common]:
+                common += 1
+            if common < len(label):
+                # Split the edge; the new middle node covers the same subtree
+                middle = _Node(label[:common])
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                middle.top = list(child.top)
+                middle.dirty = child.dirty
+                node.children[key[i]] = middle
+                child = middle
+            i += common
+            node = child
+            path.append(node)
+        node.entries.add(entry)
+        return path
+
+
+typeahead_index = TypeaheadIndex()
@@ -13,9 +13,14 @@ urlpatterns = [
     path('profile/', views.profile, name='profile'),
     path('history/', views.history, name='history'),
     path('search/', views.search_items, name='search_items'),
+    path('search/typeahead/', views.typeahead, name='typeahead'),
     path('explore/', views.explore, name='explore'),
+    path('events/availability/', views.availability_events, name='availability_events'),
+    path('similar/<str:item_type>/<int:item_id>/', views.similar_items, name='similar_items'),
+    path('borrow/batch/', views.borrow_batch, name='borrow_batch'),
     path('borrow/<str:item_type>/<int:item_id>/', views.borrow_item, name='borrow_item'),
     path('request/<int:item_id>/', views.request_item, name='request_item'),
+    path('return/batch/', views.return_batch, name='return_batch'),
     path('return/<str:item_type>/<int:item_id>/', views.return_item, name='return_item'),
     path('password-reset/', PasswordResetView.as_view(template_name='library/password_reset.html'), name='password_reset'),
     path('password-reset/done/', PasswordResetDoneView.as_view(template_name='library/password_reset_done.html'), name='password_reset_done'),
@@ -1,15 +1,26 @@
+import logging
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
-from django.db.models import Count, Q
-from .models import EBook, PrintedBook, ResearchPaper, Audiobook, BorrowingHistory
+from django.views.decorators.http import condition, require_POST
+from .models import EBook, PrintedBook, ResearchPaper, Audiobook, BorrowingHistory, BookReservation, Branch
 from .models import StudentProfile, ResearcherProfile, FacultyProfile, GuestProfile
 from .services import LibraryService, BookExplorerService
+from .branches import branch_copies
+from .events import availability_stream
+from .cards import cards_from_queryset, load_cards, open_loan_keys, with_current_copies, with_status
 from .forms import CustomSignupForm
-from django.utils import timezone
-from datetime import timedelta
+from .responses import home_etag, page_etag, render_streaming
+from .search import search_cache
+from .similarity import load_similar_items
+from .typeahead import typeahead_index
+
+logger = logging.getLogger(__name__)
 
 service = LibraryService()
 book_explorer_service = BookExplorerService()
@@ -52,6 +63,7 @@ def user_logout(request):
     return redirect('home')
 
 @login_required
+@condition(etag_func=home_etag)
 def home(request):
     user = request.user
     user_type = service.get_user_type(user)
@@ -61,20 +73,18 @@ def home(request):
     book_models = [EBook, PrintedBook, Audiobook]  # Exclude ResearchPaper
     recommendations = []
 
-    user_borrowings = BorrowingHistory.objects.filter(user=user)
-    user_genres = set()
-    for borrowing in user_borrowings:
-        item = borrowing.get_item()
-        if item and hasattr(item, 'genre'):
-            user_genres.add(item.genre)
+    # Genres and items from the loans' snapshot columns, in one query
+    user_borrowings = list(BorrowingHistory.objects.filter(user=user).values_list('item_type', 'object_id', 'item_genre'))
+    user_genres = {genre for _, _, genre in user_borrowings if genre}
 
     if user_genres:
         for model in book_models:
-            items = model.objects.filter(genre__in=user_genres).exclude(
-                id__in=[b.object_id for b in user_borrowings if b.content_type.model == model.__name__.lower()]
-            )[:5]  
+            model_name = model._meta.model_name
+            items = cards_from_queryset(model.objects.filter(genre__in=user_genres).exclude(
+                id__in=[object_id for item_type, object_id, _ in user_borrowings if item_type == model_name]
+            )[:5])
             for item in items:
-                print(f"Recommendation: {item.title} (ID: {item.id}), Genre: {item.genre}, Type: {item.__class__.__name__}")
+                logger.debug("Recommendation: %s (ID: %s), Genre: %s, Type: %s", item.title, item.id, item.genre, item.type_name)
             recommendations.extend(items)
     else:
         genre_preferences = {
@@ -85,9 +95,10 @@ def home(request):
         }
         preferred_genres = genre_preferences.get(user_type, ['Fiction', 'Technology'])
         for model in book_models:
-            items = model.objects.filter(genre__in=preferred_genres)[:5]  
+            items = cards_from_queryset(model.objects.filter(genre__in=preferred_genres)[:5])
             for item in items:
-                print(f"Recommendation (Fallback): {item.title} (ID: {item.id}), Genre: {item.genre}, Type: {item.__class__.__name__}")
+                logger.debug("Recommendation (Fallback): %s (ID: %s), Genre: %s, Type: %s",
+                             item.title, item.id, item.genre, item.type_name)
             recommendations.extend(items)
 
     import random
@@ -95,106 +106,43 @@ def home(request):
     random.shuffle(recommendations)
     recommendations = recommendations[:5]
 
-    thirty_days_ago = timezone.now().date() - timedelta(days=30)
-    trending_borrowings = BorrowingHistory.objects.filter(borrow_date__gte=thirty_days_ago)
-    book_counts = {}
-    for borrowing in trending_borrowings:
-        item = borrowing.get_item()
-        if item and item.__class__ in book_models:  
-            item_key = (item.__class__.__name__, item.id)
-            book_counts[item_key] = book_counts.get(item_key, 0) + 1
-
-    trending_items = sorted(
-        book_counts.items(),
-        key=lambda x: x[1],
-        reverse=True
-    )[:5]  
-    trending = []
-    for (item_type, item_id), count in trending_items:
-        model = next(m for m in book_models if m.__name__ == item_type)
-        try:
-            item = model.objects.get(id=item_id)
-            print(f"Trending: {item.title} (ID: {item.id}), Borrow Count: {count}, Type: {item_type}")
-            trending.append(item)
-        except model.DoesNotExist:
-            continue
-
-    if not trending:
-        all_borrowings = BorrowingHistory.objects.all()
-        book_counts = {}
-        for borrowing in all_borrowings:
-            item = borrowing.get_item()
-            if item and item.__class__ in book_models:
-                item_key = (item.__class__.__name__, item.id)
-                book_counts[item_key] = book_counts.get(item_key, 0) + 1
-        trending_items = sorted(
-            book_counts.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:5]
-        for (item_type, item_id), count in trending_items:
-            model = next(m for m in book_models if m.__name__ == item_type)
-            try:
-                item = model.objects.get(id=item_id)
-                print(f"Trending (Fallback): {item.title} (ID: {item.id}), Borrow Count: {count}, Type: {item_type}")
-                trending.append(item)
-            except model.DoesNotExist:
-                continue
-
-    research_papers = ResearchPaper.objects.all()[:5]  
-    for paper in research_papers:
-        print(f"Research Paper: {paper.title} (ID: {paper.id}), Access Level: {paper.access_level}")
-
-    all_borrowings = BorrowingHistory.objects.all()
-    book_counts = {}
-    for borrowing in all_borrowings:
-        item = borrowing.get_item()
-        if item:
-            title = item.title
-            book_counts[title] = book_counts.get(title, 0) + 1
-    most_borrowed = sorted(
-        [{'title': title, 'total': count} for title, count in book_counts.items()],
-        key=lambda x: x['total'],
-        reverse=True
-    )[:5]
-
-    # Popular Genres (for Analytics section)
-    genre_counts = {}
-    for borrowing in all_borrowings:
-        item = borrowing.get_item()
-        if item:
-            genre = item.genre
-            genre_counts[genre] = genre_counts.get(genre, 0) + 1
-    popular_genres = sorted(
-        [{'genre': genre, 'total': count} for genre, count in genre_counts.items()],
-        key=lambda x: x['total'],
-        reverse=True
-    )[:5]
+    # Trending and analytics are the same for everyone, so they come from the cache
+    sections = service.get_home_sections()
+    borrowed = open_loan_keys(user)
+    # Their copy counts change with every borrow and return, so read them fresh
+    sections['trending'] = with_status(with_current_copies(sections['trending']), user, borrowed)
+    sections['research_papers'] = with_status(sections['research_papers'], user, borrowed)
+    recommendations = with_status(recommendations, user, borrowed)
 
     return render(request, 'library/home.html', {
         'recommendations': recommendations,
-        'trending': trending,
-        'research_papers': research_papers,
-        'most_borrowed': most_borrowed,
-        'popular_genres': popular_genres,
+        **sections,
         'user_type': user_type,
     })
 
 @login_required
 def profile(request):
     user_type = service.get_user_type(request.user)
+    # One row holds the whole account summary
+    loan_state = service.get_loan_state(request.user)
     return render(request, 'library/profile.html', {
         'user_type': user_type,
+        'loan_state': loan_state,
+        'fines_block': service.fines_block(loan_state),
     })
 
 @login_required
+@condition(etag_func=page_etag)
 def history(request):
-    borrowing_history = BorrowingHistory.objects.filter(user=request.user)
+    full_history = request.GET.get('full') == '1'
+    borrowing_history = service.get_borrowing_history(request.user, include_archived=full_history)
     return render(request, 'library/history.html', {
         'borrowing_history': borrowing_history,
+        'full_history': full_history,
     })
 
 @login_required
+@condition(etag_func=page_etag)
 def search_items(request):
     query = request.GET.get('q', '')
     search_type = request.GET.get('type', 'keyword')
@@ -207,28 +155,78 @@ def search_items(request):
         models = [EBook, PrintedBook, Audiobook]
         if user_type != 'Guest':
             models.append(ResearchPaper)
-        for model in models:
-            items = model.objects.all()
-            if search_type == 'keyword':
-                items = items.filter(
-                    Q(title__icontains=query) |
-                    Q(author__icontains=query) |
-                    Q(genre__icontains=query)
-                )
-            elif search_type == 'genre':
-                items = items.filter(genre__icontains=query)
-            elif search_type == 'author':
-                items = items.filter(author__icontains=query)
-            results.extend(items)
-
-    return render(request, 'library/search_results.html', {
+        results = with_status(load_cards(search_cache.search(query, search_type, models), models), request.user)
+        # Per-branch shelves of the printed books, read from every branch at once
+        shelves = branch_copies([card.id for card in results if card.type == 'printedbook'])
+        for card in results:
+            if card.type == 'printedbook':
+                card.branch_copies = shelves.get(card.id)
+
+    context = {
         'query': query,
         'search_type': search_type,
         'results': results,
         'user_type': user_type,
-    })
+    }
+    if len(results) > settings.STREAM_RESULTS_THRESHOLD:
+        return render_streaming(request, 'library/search_results.html', context,
+                                rows_template='library/search_result_rows.html', rows_key='results')
+    return render(request, 'library/search_results.html', context)
+
+@login_required
+def typeahead(request):
+    query = request.GET.get('q', '')
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 20))
+    except ValueError:
+        limit = 10
+    user_type = service.get_user_type(request.user)
+    results = typeahead_index.complete(query, limit=limit, include_research_papers=user_type != 'Guest')
+    return JsonResponse({'query': query, 'results': results})
 
 @login_required
+def similar_items(request, item_type, item_id):
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 20))
+    except ValueError:
+        limit = 10
+    models = [EBook, PrintedBook, Audiobook]
+    if service.get_user_type(request.user) != 'Guest':
+        models.append(ResearchPaper)
+    if item_type not in {model._meta.model_name for model in models}:
+        return JsonResponse({'error': 'Unknown item type.'}, status=404)
+    results = [
+        {'type': item._meta.model_name, 'id': item.id, 'title': item.title,
+         'author': item.author, 'genre': item.genre, 'score': score}
+        for item, score in load_similar_items(item_type, item_id, models, limit=limit)
+    ]
+    return JsonResponse({'type': item_type, 'id': item_id, 'results': results})
+
+@login_required
+async def availability_events(request):
+    """Stream copy counts of the user's reserved books and ``?books=`` (printed book ids) as server-sent events."""
+    if not settings.SSE_ENABLED:
+        raise Http404
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the stream would hold a worker thread until the client leaves
+        return HttpResponse("Availability events need an ASGI server.", status=501, content_type='text/plain')
+    user = await request.auser()
+    book_ids = {int(book_id) for book_id in request.GET.get('books', '').split(',') if book_id.isdigit()}
+    book_ids.update([
+        book_id async for book_id in BookReservation.objects.filter(user=user, is_active=True)
+        .values_list('printed_book_id', flat=True)
+    ])
+    book_ids = sorted(book_ids)[:settings.SSE_MAX_WATCHED_BOOKS]
+    response = StreamingHttpResponse(availability_stream(book_ids), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let a reverse proxy buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    # Nor GZipMiddleware
+    response.gzip_exempt = True
+    return response
+
+@login_required
+@condition(etag_func=page_etag)
 def explore(request):
     user = request.user
     user_type = service.get_user_type(user)
@@ -239,7 +237,7 @@ def explore(request):
     selected_genre = request.GET.get('genre', None)
     books = []
     if selected_genre:
-        books = book_explorer_service.get_books_by_genre(selected_genre, user)
+        books = with_status(book_explorer_service.get_books_by_genre(selected_genre, user), user)
         print(f"Explore - Genre: {selected_genre}, Found {len(books)} books")
 
     return render(request, 'library/explore.html', {
@@ -247,6 +245,7 @@ def explore(request):
         'selected_genre': selected_genre,
         'books': books,
         'user_type': user_type,
+        'live_availability': settings.SSE_ENABLED,
     })
 
 @login_required
@@ -276,8 +275,15 @@ def borrow_item(request, item_type, item_id):
         messages.error(request, "Invalid item type.")
         return redirect('home')
 
+    branch = None
+    if request.POST.get('branch'):
+        branch = Branch.objects.filter(code=request.POST['branch']).first()
+        if branch is None:
+            messages.error(request, "Branch not found.")
+            return redirect('home')
+
     try:
-        success, message = service.borrow_item(request.user, item)
+        success, message = service.borrow_item(request.user, item, branch=branch)
         if success:
             messages.success(request, message)
         else:
@@ -287,6 +293,64 @@ def borrow_item(request, item_type, item_id):
     genre = request.GET.get('genre', '')
     return redirect('explore' + (f'?genre={genre}' if genre else ''))
 
+MAX_BATCH_ITEMS = 100
+
+def get_batch_items(request):
+    # Items are posted as repeated `items` values of the form "<item_type>:<id>",
+    # e.g. items=printedbook:12&items=ebook:7. Returns the resolved items and
+    # result entries for the ones that couldn't be resolved.
+    model_map = {
+        'ebook': EBook,
+        'printedbook': PrintedBook,
+        'audiobook': Audiobook,
+    }
+    refs, errors = [], []
+    for ref in dict.fromkeys(request.POST.getlist('items')):
+        item_type, _, item_id = ref.partition(':')
+        if item_type not in model_map or not item_id.isdigit():
+            errors.append({'item': ref, 'success': False, 'message': "Invalid item type."})
+        else:
+            refs.append((ref, item_type, int(item_id)))
+
+    found = {}
+    for item_type, model in model_map.items():
+        ids = [item_id for _, ref_type, item_id in refs if ref_type == item_type]
+        if ids:
+            for item_id, item in model.objects.in_bulk(ids).items():
+                found[(item_type, item_id)] = item
+
+    items = []
+    for ref, item_type, item_id in refs:
+        if (item_type, item_id) in found:
+            items.append(found[(item_type, item_id)])
+        else:
+            errors.append({'item': ref, 'success': False, 'message': "Item not found."})
+    return items, errors
+
+def batch_response(results, errors):
+    return JsonResponse({'results': [
+        {'item': f"{item._meta.model_name}:{item.id}", 'success': success, 'message': message}
+        for item, success, message in results
+    ] + errors})
+
+@login_required
+@require_POST
+def borrow_batch(request):
+    if len(request.POST.getlist('items')) > MAX_BATCH_ITEMS:
+        return JsonResponse({'error': f"At most {MAX_BATCH_ITEMS} items per request."}, status=400)
+    if service.get_user_type(request.user) == 'Guest':
+        return JsonResponse({'error': "Guests are not allowed to borrow items."}, status=403)
+    items, errors = get_batch_items(request)
+    return batch_response(service.borrow_items(request.user, items), errors)
+
+@login_required
+@require_POST
+def return_batch(request):
+    if len(request.POST.getlist('items')) > MAX_BATCH_ITEMS:
+        return JsonResponse({'error': f"At most {MAX_BATCH_ITEMS} items per request."}, status=400)
+    items, errors = get_batch_items(request)
+    return batch_response(service.return_items(request.user, items), errors)
+
 @login_required
 def request_item(request, item_id):
     user_type = service.get_user_type(request.user)
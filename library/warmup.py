@@ -0,0 +1,88 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, connections
+from django.template import engines
+
+from library.services import LibraryService, BookExplorerService
+from library.typeahead import typeahead_index
+
+logger = logging.getLogger(__name__)
+
+
+def warm_genres():
+    BookExplorerService().get_all_genres(refresh=True)
+
+
+def warm_home_sections():
+    LibraryService().get_home_sections(refresh=True)
+
+
+def warm_typeahead():
+    typeahead_index.build()
+
+
+def warm_search_index():
+    # Reads the whole FTS5 term index once, pulling it into SQLite's page cache
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*), SUM(doc) FROM library_itemtrigram_vocab")
+        cursor.fetchone()
+
+
+def warm_templates():
+    for engine in engines.all():
+        for template_dir in getattr(engine, 'template_dirs', ()):
+            for root, _, files in os.walk(template_dir):
+                for name in files:
+                    if name.endswith(('.html', '.txt')):
+                        path = os.path.relpath(os.path.join(root, name), template_dir)
+                        engine.get_template(path.replace(os.sep, '/'))
+
+
+# (name, function, shared). Shared stages fill the cache every worker reads
+# and are what `manage.py warm_caches` runs; the others only warm the process
+# that runs them, so each worker runs them as it starts (see warm_worker()).
+STAGES = [
+    ('genres', warm_genres, True),
+    ('home_sections', warm_home_sections, True),
+    ('search_index', warm_search_index, True),
+    ('typeahead', warm_typeahead, False),
+    ('templates', warm_templates, False),
+]
+
+
+def _run_stage(name, func):
+    start = time.perf_counter()
+    try:
+        func()
+        error = None
+    except Exception as e:
+        error = e
+    finally:
+        # Stages run in pool threads, each with its own connections
+        connections.close_all()
+    return name, time.perf_counter() - start, error
+
+
+def shared_stages():
+    return [name for name, _, shared in STAGES if shared]
+
+
+def warm_up(stages=None, workers=None):
+    """Run the warm-up stages in parallel and return ``(name, seconds, error)`` tuples."""
+    selected = [(name, func) for name, func, _ in STAGES if stages is None or name in stages]
+    if not selected:
+        return []
+    with ThreadPoolExecutor(max_workers=workers or len(selected)) as pool:
+        return list(pool.map(lambda stage: _run_stage(*stage), selected))
+
+
+def warm_worker():
+    """Run the in-process stages; called by Nexus/wsgi.py and Nexus/asgi.py as a worker starts."""
+    results = warm_up([name for name, _, shared in STAGES if not shared])
+    for name, _, error in results:
+        if error is not None:
+            logger.warning("Warming %s failed: %s", name, error)
+    return results